@@ -20,7 +20,7 @@
 ##############################################################################
 {
     'name': 'Application Integration',
-    'version': '0.2',
+    'version': '0.3',
     'category': 'Tools',
     'description': """Framework for interfacing data from other applications.""",
     'author': 'Open2bizz',
@@ -33,6 +33,7 @@
         'views/application_integration_menu.xml',
         'security/application_integration_security.xml',
         'security/ir.model.access.csv',
+        'data/application_integration_data.xml',
     ],
     'demo_xml': [],
     'installable': True,
@@ -0,0 +1,93 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+from openerp import http
+from openerp.http import request
+from openerp.modules.registry import RegistryManager
+
+from openerp.addons.application_integration.models.application_integration import ApplicationScheduler
+from openerp.addons.application_integration.models.metrics import render_metrics
+
+from contextlib import closing
+
+import werkzeug
+
+
+class ApplicationIntegrationMetrics(http.Controller):
+
+    @http.route('/application_integration/metrics', type='http', auth='none')
+    def metrics(self, db=None, token=None, **kwargs):
+        """Metrics (Prometheus text format) of the applications of a
+        database, for this process. Requires the token of system parameter
+        application_integration.metrics_token."""
+        dbname = db or request.db
+        if not dbname or dbname not in http.db_filter([dbname]):
+            raise werkzeug.exceptions.NotFound()
+
+        registry = RegistryManager.get(dbname)
+        with closing(registry.cursor()) as cr:
+            cr.execute("SELECT value FROM ir_config_parameter WHERE key = 'application_integration.metrics_token'")
+            row = cr.fetchone()
+            if not row or not row[0] or token != row[0]:
+                raise werkzeug.exceptions.Forbidden()
+
+            cr.execute("SELECT id, name FROM application_integration_application")
+            names = dict(cr.fetchall())
+
+            # Cheap aggregate: only the ready/processing rows, one select per
+            # state, so each one uses the partial index of its queue
+            cr.execute(
+                """
+                SELECT
+                  application,
+                  'ready',
+                  count(*),
+                  extract(epoch FROM (now() at time zone 'UTC') - min(write_date))
+                FROM
+                  application_integration_data
+                WHERE
+                  state = 'ready'
+                GROUP BY
+                  application
+                UNION ALL
+                SELECT
+                  application,
+                  'processing',
+                  count(*),
+                  extract(epoch FROM (now() at time zone 'UTC') - min(write_date))
+                FROM
+                  application_integration_data
+                WHERE
+                  state = 'processing'
+                GROUP BY
+                  application"""
+            )
+            queue = {}
+            for (app_id, state, count, age) in cr.fetchall():
+                queue.setdefault(app_id, {})[state] = (count, age)
+
+        in_flight = {}
+        scheduler = ApplicationScheduler.get(dbname)
+        if scheduler is not None:
+            for app in scheduler.applications.values():
+                in_flight[app.application_id] = app.in_flight
+
+        body = render_metrics(dbname, names, queue, in_flight)
+        return request.make_response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
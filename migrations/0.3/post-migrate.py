@@ -0,0 +1,74 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+Compress the existing (large) data, and set the size and preview of all data.
+"""
+from openerp.addons.application_integration.models.payload import pack_payload
+from openerp.addons.application_integration.models.application_integration import PAYLOAD_THRESHOLD
+
+import logging
+
+_logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1000
+
+
+def migrate(cr, version):
+    if not version:
+        return
+
+    cr.execute("SELECT value FROM ir_config_parameter WHERE key = 'application_integration.payload_threshold'")
+    row = cr.fetchone()
+    threshold = int(row[0]) if row else PAYLOAD_THRESHOLD
+
+    cr.execute("SELECT value FROM ir_config_parameter WHERE key = 'application_integration.payload_codec'")
+    row = cr.fetchone()
+    codec = row[0] if row else 'zlib'
+
+    count = last_id = 0
+    while True:
+        # By key (primary key index), not re-reading the converted rows
+        cr.execute(
+            "SELECT id, data_inline FROM application_integration_data "
+            " WHERE id > %s AND data_size IS NULL ORDER BY id LIMIT %s",
+            (last_id, CHUNK_SIZE)
+        )
+        rows = cr.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        values = ', '.join(
+            cr.mogrify("(%s, %s::text, %s::bytea, %s::varchar, %s::integer, %s::varchar)",
+                       (id,) + pack_payload(data, threshold, codec))
+            for (id, data) in rows
+        )
+        cr.execute(
+            "UPDATE application_integration_data AS data "
+            "   SET data_inline = packed.data_inline, payload = packed.payload, data_codec = packed.data_codec, "
+            "       data_size = packed.data_size, data_preview = packed.data_preview "
+            "  FROM (VALUES " + values + ") "
+            "    AS packed(id, data_inline, payload, data_codec, data_size, data_preview) "
+            " WHERE data.id = packed.id"
+        )
+        count += len(rows)
+
+    _logger.info('Application Integration: stored the payload of %s data lines', count)
@@ -0,0 +1,38 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+The (inline) data column is renamed, data became a computed field over the
+inline and the compressed payload.
+"""
+
+
+def migrate(cr, version):
+    if not version:
+        return
+
+    cr.execute(
+        "SELECT 1 FROM information_schema.columns "
+        " WHERE table_name = 'application_integration_data' AND column_name = 'data_inline'"
+    )
+    if cr.fetchone():
+        return
+
+    cr.execute("ALTER TABLE application_integration_data RENAME COLUMN data TO data_inline")
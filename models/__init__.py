@@ -18,4 +18,9 @@
 #    along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #
 ##############################################################################
+import payload
+import metrics
+import worker
+import profiling
 import application_integration
+import archive
@@ -23,43 +23,912 @@ Test lock in psql:
 BEGIN ;
 SELECT * FROM application_integration_data WHERE id=<the id> FOR UPDATE NOWAIT
 """
-from openerp import models, fields, api, SUPERUSER_ID
+from openerp import models, fields, api, exceptions, sql_db, SUPERUSER_ID
 from openerp.modules.registry import RegistryManager
+from openerp.tools import split_every, plaintext2html, DEFAULT_SERVER_DATETIME_FORMAT
 
-from contextlib import closing
+from openerp.tools.lru import LRU
 
+from payload import pack_payload, payload_hash, unpack_payload, prettify_payload
+from metrics import JobStats, application_metrics
+from worker import HEARTBEAT_INTERVAL, worker_timeout
+from profiling import JobProfiler
+
+from contextlib import closing, contextmanager
+
+import ast
+import atexit
+import base64
+import errno
+import fcntl
+import itertools
 import logging
+import math
+import multiprocessing
+import os
+import psycopg2
+import random
+import Queue
+import re
+import select
+import signal
 import time
 import threading
 import sys
+import tempfile
 import lxml.etree as etree
+from cStringIO import StringIO
+from datetime import datetime, timedelta
+from uuid import uuid4
 
 _logger = logging.getLogger(__name__)
+_slow_logger = logging.getLogger(__name__ + '.slow')
+
+# PostgreSQL channel on which an application is notified about ready data
+NOTIFY_CHANNEL = 'application_integration_%s'
+
+# PostgreSQL channel on which the schedulers are notified about started,
+# stopped or changed applications
+CONTROL_CHANNEL = 'application_integration'
+
+# Seconds between (fallback) refreshes of the started applications
+REFRESH_INTERVAL = 60
+
+# Seconds the scheduler waits after an unexpected error
+ERROR_DELAY = 10
+
+# Data lines per multi-row INSERT (create_batch), and the supported fields
+INSERT_BATCH_SIZE = 1000
+BATCH_FIELDS = set([
+    'application', 'state', 'data', 'message', 'priority', 'partition_key', 'idempotency_key', 'file', 'filename'
+])
+
+# Longest delay (seconds) between retries of a failed data line
+RETRY_MAX_DELAY = 24 * 60 * 60
+
+# Bytes above which data is stored compressed (off-row), unless configured
+PAYLOAD_THRESHOLD = 2048
+
+# Bytes above which data is not parsed to pretty print, unless configured
+PRETTY_MAX_SIZE = 1024 * 1024
+
+# Adaptive rate limits: lowest rate (fraction of the limit) after failures,
+# and recovery (fraction of the limit) after every successful job (batch)
+RATE_MIN_FACTOR = 1.0 / 64
+RATE_RECOVERY = 0.1
+
+# First key of the (two keys) advisory locks of the processing slots of the
+# applications, plus the slot; the second key is the application id
+SLOT_LOCK_NAMESPACE = 0x41490000
+
+# Job timeouts: seconds between checks of the watchdog, and seconds a job
+# may run on after its timeout (statement cancelled) before its worker gets
+# abandoned (replaced)
+WATCHDOG_INTERVAL = 1
+ABANDON_GRACE = 10
+
+# Seconds the jobs in progress get to finish when a scheduler stops (drain),
+# before they are given up (requeued once their connections are gone)
+DRAIN_TIMEOUT = 30
+
+# Valid source states of the (bulk) state transitions, by target state
+TRANSITIONS = {
+    'ready': ('draft', 'cancel', 'done', 'error', 'dead'),
+    'cancel': ('draft', 'ready', 'error', 'dead'),
+}
+
+# Data lines archived/deleted per transaction, by the retention
+RETENTION_CHUNK = 5000
+
+# Pretty printed data, by (dbname, id, write_date)
+_pretty_cache = LRU(64)
+
+# Set in the worker processes of the 'process' execution mode
+_worker_process = False
+_worker_process_processors = {}
+
+
+def retry_backoff(attempt_count, retry_delay, retry_jitter):
+    """Seconds before the next attempt, after `attempt_count` attempts:
+    exponential backoff, with random jitter"""
+    delay = min(retry_delay * 2 ** max(attempt_count - 1, 0), RETRY_MAX_DELAY)
+    return delay + random.uniform(0, delay * retry_jitter)
+
+
+def _init_worker_process():
+    """Initializer of the worker processes (forked from an Odoo process).
+
+    The database connections and registries are inherited from the parent
+    process: never use (or close) them here, but start with fresh ones.
+    """
+    global _worker_process
+    _worker_process = True
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+    # Locks are inherited in whatever state the threads of the parent
+    # process held them at the fork (Python 2 does not reset them)
+    logging._lock = threading.RLock()
+    loggers = [logging.getLogger()] + logging.Logger.manager.loggerDict.values()
+    for logger in loggers:
+        for handler in getattr(logger, 'handlers', []):
+            handler.createLock()
+    RegistryManager._lock = threading.RLock()
+
+    sql_db._Pool = None
+    RegistryManager.registries.clear()
+
+
+class JobTimeout(Exception):
+    """A job (or batch) exceeded the job timeout of its application"""
+
+    def __init__(self, timeout):
+        super(JobTimeout, self).__init__("Timeout: no result after %s seconds" % timeout)
+
+
+@contextmanager
+def _alarm(seconds):
+    """Raise JobTimeout in the block after `seconds` (main thread only, as
+    in the worker processes)"""
+    def timeout(signum, frame):
+        raise JobTimeout(seconds)
+
+    previous = signal.signal(signal.SIGALRM, timeout)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
 
 
-class ApplicationThread(threading.Thread):
+def parse_handler_args(text):
+    """(args, kwargs) of the method of an application, from its `args`: a
+    Python literal, a tuple or list of positional arguments or a dict of
+    keyword arguments (anything else is a single positional argument)."""
+    if not text or not text.strip():
+        return (), {}
+
+    try:
+        value = ast.literal_eval(text.strip())
+    except (SyntaxError, ValueError) as e:
+        raise ValueError("Invalid arguments %r: %s" % (text, e))
+
+    if isinstance(value, dict):
+        return (), value
+    if isinstance(value, (tuple, list)):
+        return tuple(value), {}
+    return (value,), {}
+
+
+class ApplicationHandler(object):
     """
-    Application Thread
+    The method of an application with its parsed arguments, resolved and
+    validated once (start or change of the application) instead of per job.
+    Picklable, for the worker processes.
     """
 
-    def __init__(self, name, application_id, dbname, stopper):
-        super(ApplicationThread, self).__init__(name=name)
+    def __init__(self, model, function, args=None, batch_method=False, job_timeout=0, slow_threshold=0,
+                 savepoints=False, application_id=None, profile_mode='off', profile_rate=0.0):
+        self.model = model
+        self.function = function
+        self.args, self.kwargs = parse_handler_args(args)
+        self.batch_method = batch_method
+        self.job_timeout = job_timeout
+        self.slow_threshold = slow_threshold
+        # One transaction per batch, a savepoint per job
+        self.savepoints = savepoints
+        self.application_id = application_id
+        self.profile_mode = profile_mode
+        self.profile_rate = profile_rate
+
+    @classmethod
+    def from_application(cls, app_obj):
+        return cls(app_obj.model, app_obj.function, app_obj.args, app_obj.batch_method,
+                   app_obj.job_timeout, app_obj.slow_job_threshold, app_obj.transaction_mode == 'batch',
+                   app_obj.id, app_obj.profile_mode, app_obj.profile_sample_rate)
+
+    def profiled(self):
+        """Whether to profile a call: every call (slow calls are kept, only
+        with a slow job threshold), or a random sample"""
+        if self.profile_mode == 'threshold':
+            return bool(self.slow_threshold)
+        return self.profile_mode == 'sample' and random.random() < self.profile_rate
+
+    def validate(self, env):
+        """Raise a ValueError unless the model and its method exist"""
+        if not self.model or self.model not in env.registry:
+            raise ValueError("Model '%s' does not exist" % self.model)
+        if not self.function or self.function.startswith('_') or \
+                not callable(getattr(env[self.model], self.function, None)):
+            raise ValueError("Model '%s' has no (public) method '%s'" % (self.model, self.function))
+
+    def call(self, env, records):
+        """Call the method (in `env`) for the job(s) `records`"""
+        return getattr(env[self.model], self.function)(records, *self.args, **self.kwargs)
+
+    def __str__(self):
+        return '%s.%s' % (self.model, self.function)
+
+
+def _process_job_in_process(dbname, claim_uuid, job_ids, handler):
+    """Process jobs in a worker process, with its own registry and cursor"""
+    try:
+        processor = _worker_process_processors.get((dbname, claim_uuid))
+        if processor is None:
+            processor = ApplicationJobProcessor(RegistryManager.get(dbname), claim_uuid)
+            _worker_process_processors[(dbname, claim_uuid)] = processor
+
+        return processor.process(job_ids, handler)
+    except Exception as e:
+        _logger.error('Application Integration worker process %s: %s', os.getpid(), e)
+
+
+class ApplicationJobProcessor(object):
+    """
+    Processes the jobs claimed by an Application Scheduler, in a worker thread
+    of this process or in a worker process
+    """
 
-        self.local = threading.local()
+    def __init__(self, registry, claim_uuid, watchdog=None):
+        self.registry = registry
+        self.claim_uuid = claim_uuid
+        self.watchdog = watchdog
 
-        self.local.name = name
-        self.local.application_id = application_id
-        self.local.dbname = dbname
-        self.local.stopper = stopper
+    def new_db_cursor(self):
+        return self.registry.cursor()
 
-        # Set locals on thread object
-        self.name = self.local.name
-        self.application_id = self.local.application_id
-        self.dbname = self.local.dbname
-        self.stopper = self.local.stopper
+    def call_handler(self, handler, job_env, records, lock_cr, profiles, batch_ids=None):
+        """Call the handler for the job(s) `records`, profiled as far as the
+        application asks: the values of the profile are added to `profiles`
+        (see call_timed for the other arguments)."""
+        if not handler.profiled():
+            return self.call_timed(handler, job_env, records, lock_cr, batch_ids)
 
-        self.local.registry = RegistryManager.get(self.dbname)
-        self.registry = self.local.registry
+        profiler = JobProfiler(job_env.cr)
+        try:
+            with profiler:
+                return self.call_timed(handler, job_env, records, lock_cr, batch_ids)
+        finally:
+            if handler.profile_mode == 'sample' or \
+                    (handler.slow_threshold and profiler.duration >= handler.slow_threshold):
+                profiles.append(profiler.values(handler, records.ids))
+
+    def save_profiles(self, handler, profiles):
+        """Store the profiles of handler calls, in a transaction of their
+        own. Only once the jobs are no longer locked: the links to the jobs
+        (foreign keys) need a share lock of their rows."""
+        try:
+            with closing(self.new_db_cursor()) as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                for values in profiles:
+                    env['application.integration.profile'].create(values)
+                cr.commit()
+        except Exception:
+            _logger.exception('Application Integration %s: failed to store %s profiles', handler, len(profiles))
+
+    def call_timed(self, handler, job_env, records, lock_cr, batch_ids=None):
+        """Call the handler for the job(s) `records`, within the job timeout
+        of the application: a statement timeout, plus an alarm (worker
+        process) or the watchdog (worker thread), which raise JobTimeout.
+        `batch_ids` are all jobs of the transaction (savepoints), given back
+        if the watchdog has to abandon it."""
+        timeout = handler.job_timeout
+        if not timeout:
+            return handler.call(job_env, records)
+
+        job_env.cr.execute("SET LOCAL statement_timeout = %s", (int(timeout * 1000),))
+
+        if _worker_process:
+            with _alarm(timeout):
+                return handler.call(job_env, records)
+
+        if self.watchdog is None:
+            return handler.call(job_env, records)
+
+        watch = self.watchdog.watch(handler, records.ids, timeout, job_env.cr, lock_cr, batch_ids)
+        try:
+            result = handler.call(job_env, records)
+        except Exception:
+            if self.watchdog.unwatch(watch):
+                raise JobTimeout(timeout)
+            raise
+        if self.watchdog.unwatch(watch):
+            raise JobTimeout(timeout)
+        return result
+
+    def log_slow(self, handler, job_ids, seconds):
+        if handler.slow_threshold and seconds >= handler.slow_threshold:
+            _slow_logger.warning("Slow job: %s took %.2f seconds for data line(s) %s", handler, seconds, job_ids)
+
+    def process(self, job_ids, handler):
+        """Process the jobs one by one, or all at once (batch method), with
+        the ApplicationHandler of their application. Returns their JobStats.
+
+        Jobs without a (committed) result, e.g. locked by another
+        transaction or failed to write, are given back."""
+        stats = JobStats()
+        written, profiles = [], []
+
+        with api.Environment.manage():
+            try:
+                with closing(self.new_db_cursor()) as cr:
+                    env = api.Environment(cr, SUPERUSER_ID, {})
+                    jobs = env['application.integration.data'].browse(job_ids)
+
+                    if handler.savepoints:
+                        written.extend(self.process_savepoints(env, handler, jobs, stats, profiles))
+                    elif handler.batch_method:
+                        written.extend(self.process_batch(env, handler, jobs, stats, profiles))
+                    else:
+                        for obj in jobs:
+                            written.extend(self.process_job(env, handler, obj, stats, profiles))
+            finally:
+                # The cursor (and its row locks) is gone
+                unwritten = set(job_ids) - set(written)
+                if unwritten:
+                    self.release(list(unwritten))
+                if profiles:
+                    self.save_profiles(handler, profiles)
+
+        return stats
+
+    def release(self, job_ids):
+        """Give back the jobs still in processing, claimed by this scheduler"""
+        try:
+            with closing(self.new_db_cursor()) as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env['application.integration.data'].browse(job_ids)._release_jobs(self.claim_uuid)
+                cr.commit()
+        except Exception:
+            _logger.exception('Application Integration: failed to give back data line(s) %s', job_ids)
+
+    def process_job(self, env, handler, obj, stats, profiles):
+        """Process one claimed job. The job row stays locked (by the cursor
+        of `env`) until its state has been written and committed. Returns
+        the ids of the jobs with a committed result."""
+        cr = env.cr
+
+        try:
+            cr.execute(
+                """
+                SELECT
+                  id
+                FROM
+                  application_integration_data
+                WHERE
+                  id = %s
+                  AND state = 'processing'
+                  AND claim_uuid = %s
+                FOR UPDATE NOWAIT""",
+                (obj.id, self.claim_uuid),
+                log_exceptions=False
+            )
+
+            locked_job = cr.fetchone()
+        except Exception:
+            _logger.info(("Error locking application.integration.data job: %s" % sys.exc_info()[1]))
+            cr.rollback()
+            return []
+
+        if not locked_job:
+            _logger.debug("Job `%s` no longer claimed by this thread/process. skipping it", obj.id)
+            cr.rollback()
+            return []
+
+        with closing(self.new_db_cursor()) as job_cr:
+            start = time.time()
+            try:
+                job_env = api.Environment(job_cr, SUPERUSER_ID, {})
+
+                _logger.info("Calling model.method: %s" % handler)
+
+                result = self.call_handler(handler, job_env, obj, cr, profiles)
+                handled = time.time()
+
+                if result[0]:
+                    job_cr.commit()
+                else:
+                    job_cr.rollback()
+
+                results = {obj.id: (result[0], result[1])}
+            except Exception as e:
+                handled = time.time()
+                _logger.error("Error calling %s: %s - %s" % (handler, sys.exc_info()[0], sys.exc_info()[1]))
+
+                job_cr.rollback()
+                results = {obj.id: (False, "%s" % e)}
+
+        stats.count(obj._write_results(results))
+        cr.commit()
+
+        stats.handler.append(handled - start)
+        stats.commit.append(time.time() - handled)
+        self.log_slow(handler, [obj.id], handled - start)
+        return [obj.id]
+
+    def process_batch(self, env, handler, jobs, stats, profiles):
+        """Process claimed jobs in one call of the (batch) method, which
+        returns a result per job: a dict {id: [ok, message]} or a list of
+        [ok, message], in order of the jobs. The method's changes are
+        committed unless it raises or all jobs failed, the states are
+        written in bulk and committed at once. Returns the ids of the jobs
+        with a committed result."""
+        cr = env.cr
+
+        jobs = self.lock_jobs(cr, jobs)
+        if not jobs:
+            return []
+
+        with closing(self.new_db_cursor()) as job_cr:
+            start = time.time()
+            try:
+                job_env = api.Environment(job_cr, SUPERUSER_ID, {})
+
+                _logger.info("Calling model.method: %s (%s jobs)" % (handler, len(jobs)))
+
+                results = self.batch_results(jobs, self.call_handler(handler, job_env, jobs, cr, profiles))
+                handled = time.time()
+
+                if any(ok for (ok, message) in results.values()):
+                    job_cr.commit()
+                else:
+                    job_cr.rollback()
+            except Exception as e:
+                handled = time.time()
+                _logger.error("Error calling %s: %s - %s" % (handler, sys.exc_info()[0], sys.exc_info()[1]))
+
+                job_cr.rollback()
+                results = dict((id, (False, "%s" % e)) for id in jobs.ids)
+
+        stats.count(jobs._write_results(results))
+        cr.commit()
+
+        stats.handler.append(handled - start)
+        stats.commit.append(time.time() - handled)
+        self.log_slow(handler, jobs.ids, handled - start)
+        return jobs.ids
+
+    def process_savepoints(self, env, handler, jobs, stats, profiles):
+        """Process claimed jobs in a single transaction, the one of `env`
+        which locks them: each job (or the batch, for a batch method) in a
+        savepoint, rolled back if it fails. The changes of the handler and
+        the states of the jobs are committed together, once. Returns the
+        ids of the jobs with a committed result."""
+        cr = env.cr
+
+        jobs = self.lock_jobs(cr, jobs)
+        if not jobs:
+            return []
+
+        results = {}
+        for records in ([jobs] if handler.batch_method else list(jobs)):
+            cr.execute("SAVEPOINT application_job")
+            start = time.time()
+            try:
+                _logger.info("Calling model.method: %s (%s jobs)" % (handler, len(records)))
+
+                result = self.call_handler(handler, env, records, cr, profiles, jobs.ids)
+                if handler.batch_method:
+                    job_results = self.batch_results(records, result)
+                else:
+                    job_results = {records.id: (result[0], result[1])}
+            except Exception as e:
+                _logger.error("Error calling %s: %s - %s" % (handler, sys.exc_info()[0], sys.exc_info()[1]))
+                job_results = dict((id, (False, "%s" % e)) for id in records.ids)
+            handled = time.time()
+
+            if not any(ok for (ok, message) in job_results.values()):
+                cr.execute("ROLLBACK TO SAVEPOINT application_job")
+                env.invalidate_all()
+            cr.execute("RELEASE SAVEPOINT application_job")
+            results.update(job_results)
+
+            stats.handler.append(handled - start)
+            self.log_slow(handler, records.ids, handled - start)
+
+        start = time.time()
+        if handler.job_timeout:
+            cr.execute("SET LOCAL statement_timeout TO DEFAULT")
+        stats.count(jobs._write_results(results))
+        cr.commit()
+        stats.commit.append(time.time() - start)
+        return jobs.ids
+
+    def lock_jobs(self, cr, jobs):
+        """Lock the jobs still claimed by this scheduler (skipping those
+        locked by another transaction). Returns the locked jobs."""
+        try:
+            cr.execute(
+                """
+                SELECT
+                  id
+                FROM
+                  application_integration_data
+                WHERE
+                  id IN %s
+                  AND state = 'processing'
+                  AND claim_uuid = %s
+                FOR UPDATE SKIP LOCKED""",
+                (tuple(jobs.ids), self.claim_uuid),
+                log_exceptions=False
+            )
+
+            locked_ids = set(id for (id,) in cr.fetchall())
+        except Exception:
+            _logger.info(("Error locking application.integration.data jobs: %s" % sys.exc_info()[1]))
+            cr.rollback()
+            return jobs.browse()
+
+        locked = jobs.filtered(lambda job: job.id in locked_ids)
+        if not locked:
+            _logger.debug("Jobs `%s` no longer claimed by this thread/process. skipping them", jobs.ids)
+            cr.rollback()
+        return locked
+
+    def batch_results(self, jobs, result):
+        """Per job results {id: (ok, message)} of a batch method"""
+        if isinstance(result, dict):
+            results = dict((id, result.get(id)) for id in jobs.ids)
+        else:
+            results = dict(zip(jobs.ids, result))
+
+        for id in jobs.ids:
+            if not results.get(id):
+                results[id] = (False, "No result returned for this line")
+            else:
+                results[id] = (results[id][0], results[id][1])
+        return results
+
+
+class TokenBucket(object):
+    """
+    Rate limit of an application: a job may be claimed per token, tokens are
+    added at `rate` per second, up to `burst`. An adaptive rate drops
+    (halves) after failed jobs and recovers to the limit after successful
+    ones.
+    """
+
+    def __init__(self, limit, burst):
+        self.lock = threading.Lock()
+        self.limit = self.rate = None
+        self.burst = 1
+        self.configure(limit, burst)
+
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+
+    def configure(self, limit, burst):
+        with self.lock:
+            if limit != self.limit:
+                self.limit = self.rate = float(limit)
+            # Default: a second worth of jobs
+            self.burst = max(burst or int(math.ceil(limit)), 1)
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def available(self):
+        with self.lock:
+            self._refill()
+            return int(self.tokens)
+
+    def take(self, count):
+        with self.lock:
+            self.tokens -= count
+
+    def delay(self, count):
+        """Seconds until `count` tokens are available"""
+        with self.lock:
+            self._refill()
+            return max(count - self.tokens, 0) / self.rate
+
+    def adapt(self, done, failed):
+        """Multiplicative decrease after failures, additive increase after
+        successes. Returns whether the rate dropped."""
+        with self.lock:
+            if failed:
+                rate = max(self.rate / 2, self.limit * RATE_MIN_FACTOR)
+                dropped, self.rate = rate < self.rate, rate
+                return dropped
+            if done:
+                self.rate = min(self.rate + self.limit * RATE_RECOVERY, self.limit)
+            return False
+
+
+class ScheduledApplication(object):
+    """
+    Scheduling state of a (started) application in an Application Scheduler
+    """
+
+    def __init__(self, application_id):
+        self.application_id = application_id
+        self.name = None
+        self.thread_uuid = None
+
+        # Refreshed from the application record
+        self.priority = 0
+        self.poll_interval = 60
+        self.batch_size = 10
+        self.max_workers = 1
+        self.max_nodes = 1
+        self.max_in_flight = 0
+        self.execution_mode = 'thread'
+        self.transaction_mode = 'job'
+        self.batch_method = False
+        self.adaptive_rate = False
+
+        # TokenBucket, None without rate limit
+        self.bucket = None
+
+        # ApplicationHandler, None while misconfigured (not dispatched)
+        self.handler = None
+        self.handler_error = None
+
+        self.active = True
+        # Processing slot (advisory lock) held, dispatched only if leading
+        self.slot = None
+        self.leading = False
+        self.in_flight = 0
+        self.jobs_in_flight = 0
+        self.has_work = True
+        self.next_poll = 0
+
+        # Stride scheduling: the application with the lowest pass value is
+        # served first; it advances inversely proportional to the weight.
+        self.pass_value = 0.0
+
+        self.process_pool = None
+        self.process_pool_size = 0
+
+        self.metrics = None
+
+    @property
+    def weight(self):
+        """Priority 0 (highest) weighs 11, priority 10 (lowest) weighs 1"""
+        return 11 - min(max(self.priority or 0, 0), 10)
+
+    def update(self, app_obj):
+        self.name = app_obj.name
+        self.thread_uuid = app_obj.thread_uuid
+        self.priority = app_obj.priority
+        self.poll_interval = app_obj.poll_interval or 60
+        self.batch_size = app_obj.batch_size or 1
+        self.max_workers = app_obj.max_workers or 1
+        self.max_nodes = max(app_obj.max_nodes, 1)
+        self.max_in_flight = app_obj.max_in_flight or 0
+        self.execution_mode = app_obj.execution_mode or 'thread'
+        self.transaction_mode = app_obj.transaction_mode or 'job'
+        self.batch_method = app_obj.batch_method
+        self.adaptive_rate = app_obj.adaptive_rate
+
+        if app_obj.rate_limit > 0:
+            if self.bucket is None:
+                self.bucket = TokenBucket(app_obj.rate_limit, app_obj.rate_burst)
+            else:
+                self.bucket.configure(app_obj.rate_limit, app_obj.rate_burst)
+        else:
+            self.bucket = None
+
+        try:
+            handler = ApplicationHandler.from_application(app_obj)
+            handler.validate(app_obj.env)
+        except ValueError as e:
+            if self.handler_error != str(e):
+                _logger.error('Application Integration %s: not processing jobs: %s', self.name, e)
+            self.handler, self.handler_error = None, str(e)
+        else:
+            self.handler, self.handler_error = handler, None
+
+    @property
+    def dispatch_batches(self):
+        """Jobs are dispatched a batch per worker: to a batch method, or in
+        one transaction per batch"""
+        return self.batch_method or self.transaction_mode == 'batch'
+
+    @property
+    def min_claim(self):
+        """Fewest jobs worth claiming: a batch method waits for the tokens of
+        a full batch (as far as the burst allows)"""
+        if self.batch_method and self.bucket is not None:
+            return min(self.batch_size, self.bucket.burst)
+        return 1
+
+    def capacity(self):
+        """Jobs the max. in flight and the rate limit allow to claim now
+        (None: unlimited)"""
+        limits = []
+        if self.max_in_flight:
+            limits.append(self.max_in_flight - self.jobs_in_flight)
+        if self.bucket is not None:
+            limits.append(self.bucket.available())
+        return min(limits) if limits else None
+
+    def throttled(self, free):
+        """Whether only the rate limit holds back a claim: there is work, a
+        free worker (`free` in the shared pool) and room in flight, but not
+        enough tokens. Then the scheduler has to wake up for the tokens."""
+        if self.bucket is None or not self.has_work or not self.handler:
+            return False
+        if free <= 0 or self.in_flight >= self.max_workers:
+            return False
+        if self.max_in_flight and self.max_in_flight - self.jobs_in_flight < self.min_claim:
+            return False
+        return self.bucket.available() < self.min_claim
+
+    def throttle_delay(self):
+        """Seconds until the rate limit allows a claim (again)"""
+        if self.bucket is None:
+            return 0
+        return self.bucket.delay(self.min_claim)
+
+    def adapt(self, outcomes):
+        """Adaptive rate limit, after the outcomes ({state: count}) of jobs"""
+        if self.bucket is None or not self.adaptive_rate:
+            return
+
+        done = outcomes.get('done', 0)
+        failed = sum(outcomes.values()) - done
+        if self.bucket.adapt(done, failed):
+            _logger.info('Application Integration %s: %s failed jobs, rate lowered to %.2f/s',
+                         self.name, failed, self.bucket.rate)
+
+    def wake(self, virtual_time):
+        """There's (possibly) ready data. An application which was idle
+        doesn't get credit for the time it was idle."""
+        if not self.has_work:
+            self.pass_value = max(self.pass_value, virtual_time)
+        self.has_work = True
+
+    def resize_process_pool(self):
+        """(Re)create the pool of worker processes of the 'process'
+        execution mode"""
+        size = self.max_workers if self.active and self.leading and self.execution_mode == 'process' else 0
+
+        if self.process_pool is not None and self.process_pool_size != size:
+            self.close_process_pool()
+
+        if size and self.process_pool is None:
+            _logger.info('Application Integration %s: starting %s worker processes', self.name, size)
+            self.process_pool = multiprocessing.Pool(size, initializer=_init_worker_process)
+            self.process_pool_size = size
+
+    def terminate_process_pool(self, pool):
+        """Terminate a pool with a hanging worker process (from a worker
+        thread); a new one is started by the next refresh"""
+        if self.process_pool is pool:
+            self.process_pool = None
+            self.process_pool_size = 0
+        pool.terminate()
+
+    def close_process_pool(self, terminate=False):
+        if self.process_pool is not None:
+            if terminate:
+                self.process_pool.terminate()
+            else:
+                # Lets the worker processes exit after their current job
+                self.process_pool.close()
+            self.process_pool = None
+            self.process_pool_size = 0
+
+
+class ApplicationScheduler(threading.Thread):
+    """
+    Application Scheduler, dispatches the ready jobs of all started
+    applications of a database to a shared pool of workers, in order of
+    priority (weighted fair share).
+    """
+
+    # Running scheduler per database (in this process)
+    schedulers = {}
+    schedulers_lock = threading.Lock()
+
+    @classmethod
+    def get(cls, dbname):
+        return cls.schedulers.get(dbname)
+
+    @classmethod
+    def ensure_started(cls, dbname, registry):
+        """Return the running scheduler of the database, (re)started if
+        needed (e.g. for a reloaded registry). A previous scheduler first
+        drains: no jobs of the same application in two schedulers of this
+        process."""
+        with cls.schedulers_lock:
+            scheduler = cls.schedulers.get(dbname)
+            if scheduler is not None and scheduler.is_running(registry):
+                return scheduler
+
+        if scheduler is not None:
+            scheduler.shutdown()
+
+        with cls.schedulers_lock:
+            scheduler = cls.schedulers.get(dbname)
+            if scheduler is not None and scheduler.is_running(registry):
+                return scheduler
+
+            scheduler = cls(dbname, registry)
+            _logger.info('Starting Application Integration scheduler: %s', scheduler.name)
+            scheduler.setDaemon(True)
+            scheduler.start()
+
+            cls.schedulers[dbname] = scheduler
+            return scheduler
+
+    @classmethod
+    def stop_application(cls, thread_uuid, timeout=0):
+        """Stop dispatching the application (all schedulers of this process)
+        and wait up to `timeout` seconds for its jobs in progress to finish
+        (drain). Returns whether they did."""
+        for scheduler in cls.schedulers.values():
+            for app in scheduler.applications.values():
+                if app.thread_uuid == thread_uuid:
+                    app.active = False
+                    scheduler.request_refresh()
+
+        deadline = time.time() + timeout
+        while True:
+            busy = [
+                app for scheduler in cls.schedulers.values() for app in scheduler.applications.values()
+                if app.thread_uuid == thread_uuid and app.in_flight
+            ]
+            if not busy or time.time() >= deadline:
+                return not busy
+            time.sleep(0.1)
+
+    @classmethod
+    def shutdown_all(cls, timeout=DRAIN_TIMEOUT):
+        """Drain and stop the schedulers of this process (server shutdown):
+        no new claims, the queued jobs are given back and the jobs in
+        progress get up to `timeout` seconds to finish."""
+        schedulers = list(cls.schedulers.values())
+        for scheduler in schedulers:
+            scheduler.stop(timeout)
+        for scheduler in schedulers:
+            scheduler.shutdown(timeout)
+
+    def __init__(self, dbname, registry):
+        super(ApplicationScheduler, self).__init__(name='application_integration.scheduler.%s' % dbname)
+
+        self.dbname = dbname
+        self.registry = registry
+        self.uuid = str(uuid4())
+        self.stopper = threading.Event()
+
+        self.watchdog = JobWatchdog(self)
+        self.processor = ApplicationJobProcessor(self.registry, self.uuid, self.watchdog)
+
+        # Started applications, by id
+        self.applications = {}
+        self.virtual_time = 0.0
+        self.refresh_needed = True
+        self.next_refresh = 0
+        self.next_heartbeat = 0
+        self.drain_deadline = None
+
+        # Shared worker pool, processing the dispatched jobs
+        self.workers = []
+        self.worker_seq = itertools.count(1)
+        self.pool_size = 0
+        self.queue = Queue.Queue()
+        self.in_flight = 0
+        # Ids of the dispatched jobs, until done (see heartbeat), and of
+        # those with a partition key (holding back the next lines of the key)
+        self.claimed = set()
+        self.keyed = set()
+        self.retiring = 0
+        self.lock = threading.Lock()
+        self._closed = False
+
+        # Self-pipe, to interrupt the wait for notifications (e.g. on stop)
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        for fd in (self._wakeup_r, self._wakeup_w):
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+        self.listen_cr = None
+        self.channels = set()
 
     def new_db_cursor(self):
         return self.registry.cursor()
@@ -69,101 +938,749 @@ class ApplicationThread(threading.Thread):
         Runs in a *new* database cursor
         """
 
-        while not self.stopper.is_set():
-            with api.Environment.manage(), closing(self.new_db_cursor()) as cr:
-                env = api.Environment(cr, SUPERUSER_ID, {})
+        try:
+            # Started while the registry gets loaded (autostart)
+            while not self.registry.ready and not self.stopper.is_set():
+                self.stopper.wait(1)
+
+            self.watchdog.setDaemon(True)
+            self.watchdog.start()
 
-                self.check_valid_application(env)
-                self.process_application_data(env)
+            while not self.stopper.is_set():
+                # Listen before refresh/dispatch, so no notification gets lost
+                self.listen()
 
-            time.sleep(60)
+                try:
+                    with api.Environment.manage(), closing(self.new_db_cursor()) as cr:
+                        env = api.Environment(cr, SUPERUSER_ID, {})
+
+                        if self.refresh_needed or time.time() >= self.next_refresh:
+                            self.refresh_applications(env)
+                            self.listen()
+
+                        if time.time() >= self.next_heartbeat:
+                            self.heartbeat(env)
+
+                        self.dispatch(env)
+                except Exception:
+                    _logger.exception('Application Integration scheduler %s: error, retrying', self.name)
+                    self.refresh_needed = True
+                    self.stopper.wait(ERROR_DELAY)
+                    continue
+
+                self.wait(self.next_timeout())
+        finally:
+            # Drain: no new claims, the jobs in progress finish (the slots
+            # are only released once they did)
+            self.stop_workers()
+            drained = self.join_workers(self.drain_deadline or time.time())
+            self.watchdog.stopper.set()
+            self.unlisten()
+
+            for app in self.applications.values():
+                app.close_process_pool(terminate=not drained)
+
+            self.unregister()
+
+            with self.lock:
+                self._closed = True
+                os.close(self._wakeup_r)
+                os.close(self._wakeup_w)
+
+            with self.schedulers_lock:
+                if self.schedulers.get(self.dbname) is self:
+                    del self.schedulers[self.dbname]
         return
 
+    def stop(self, timeout=DRAIN_TIMEOUT):
+        """Stop claiming jobs, the jobs in progress get up to `timeout`
+        seconds to finish (thread-safe)"""
+        if not self.stopper.is_set():
+            self.drain_deadline = time.time() + timeout
+        self.stopper.set()
+        self.wakeup()
+
+    def shutdown(self, timeout=DRAIN_TIMEOUT):
+        """Stop, and wait for the scheduler to drain and exit"""
+        self.stop(timeout)
+        if self.is_alive() and self is not threading.current_thread():
+            # Plus the time to give back the jobs and clean up
+            self.join(timeout + ERROR_DELAY)
+
+    def is_running(self, registry):
+        return self.is_alive() and not self.stopper.is_set() and self.registry is registry
+
+    def request_refresh(self):
+        """Refresh the started applications (thread-safe)"""
+        self.refresh_needed = True
+        self.wakeup()
+
+    def wakeup(self):
+        """Interrupt a pending wait (thread-safe)"""
+        with self.lock:
+            if self._closed:
+                return
+
+            try:
+                os.write(self._wakeup_w, '.')
+            except OSError as e:
+                # Pipe full (a wakeup is already pending)
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def is_application_alive(self, thread_uuid):
+        """Whether the application is started, or still has jobs in
+        progress, in this scheduler"""
+        if not self.is_alive():
+            return False
 
-    def check_valid_application(self, env):
-        application_model = env['application.integration.application']
+        for app in self.applications.values():
+            if app.thread_uuid == thread_uuid and (app.active or app.in_flight):
+                return True
 
-        app_obj = application_model.search(
-            [('id', '=', self.application_id)],
-            limit=1
-        )
+        return False
 
-        # Maybe application was removed while active thread.
-        if not app_obj:
-            _logger.info('Aborting Application Thread... No Application for Id: %s' % self.application_id)
-            self.stopper.set()
-            return
+    def listen(self):
+        """LISTEN on the control channel and on the channels of the started
+        applications, in a dedicated autocommit connection."""
+        channels = set([CONTROL_CHANNEL])
+        channels.update(NOTIFY_CHANNEL % app.application_id for app in self.applications.values() if app.active and app.leading)
 
-        # Maybe application was stopped while active thread.
-        if app_obj and app_obj.thread_uuid is False:
-            _logger.info('Aborting Application Thread... Application %s stopped' % app_obj.name)
-            self.stopper.set()
+        try:
+            if self.listen_cr is None:
+                cr = sql_db.db_connect(self.dbname).cursor()
+                cr.autocommit(True)
+                self.listen_cr = cr
+                self.channels = set()
+                # (Re)acquire the processing slots, in this session
+                self.refresh_needed = True
+
+            for channel in channels - self.channels:
+                self.listen_cr.execute('LISTEN "%s"' % channel)
+            for channel in self.channels - channels:
+                self.listen_cr.execute('UNLISTEN "%s"' % channel)
+            self.channels = channels
+        except Exception as e:
+            _logger.warning('Application Integration scheduler %s: LISTEN failed, polling only: %s', self.name, e)
+            self.unlisten()
+
+    def unlisten(self):
+        """Close the listen connection, which releases the processing slots"""
+        for app in self.applications.values():
+            app.slot = None
+
+        if self.listen_cr is None:
             return
 
-    def process_application_data(self, env):
-        data_model = env['application.integration.data']
-        objects = data_model.search(
-            [('state', '=', 'ready'), ('application', '=', self.application_id)]
+        try:
+            # The connection goes back to the pool: leave no session state
+            self.listen_cr.execute('UNLISTEN *')
+            self.listen_cr.execute('SELECT pg_advisory_unlock_all()')
+        except Exception:
+            pass
+        try:
+            self.listen_cr.close()
+        except Exception:
+            pass
+        self.listen_cr = None
+        self.channels = set()
+
+    def update_slot(self, app):
+        """Hold a processing slot of the started application, as far as
+        its Nodes allow: a session advisory lock in the listen connection,
+        so a crashed node releases its slots right away. An application is
+        only dispatched by the schedulers holding a slot of it."""
+        cr = self.listen_cr
+
+        if cr is None:
+            # No session to hold the slots in (LISTEN failed): uncoordinated
+            leading = app.active
+        else:
+            try:
+                # Slot of a stopped application: released once drained
+                if app.slot is not None and ((not app.active and not app.in_flight) or app.slot >= app.max_nodes):
+                    cr.execute("SELECT pg_advisory_unlock(%s, %s)", (SLOT_LOCK_NAMESPACE + app.slot, app.application_id))
+                    app.slot = None
+
+                if app.active and app.slot is None:
+                    for slot in range(app.max_nodes):
+                        cr.execute("SELECT pg_try_advisory_lock(%s, %s)", (SLOT_LOCK_NAMESPACE + slot, app.application_id))
+                        if cr.fetchone()[0]:
+                            app.slot = slot
+                            break
+            except Exception as e:
+                _logger.warning('Application Integration scheduler %s: lost LISTEN connection: %s', self.name, e)
+                self.unlisten()
+            leading = app.slot is not None
+
+        if app.active and leading != app.leading:
+            _logger.info('Application Integration scheduler %s: %s %s', self.name,
+                         'processing' if leading else 'standby (all slots taken) for', app.name)
+        app.leading = leading
+
+    def heartbeat(self, env):
+        """Register this scheduler (heartbeat, processed applications) and
+        requeue the jobs of stale schedulers, of any node, and its own jobs
+        left in processing (claimed, but not dispatched or done)."""
+        self.next_heartbeat = time.time() + HEARTBEAT_INTERVAL
+
+        worker_model = env['application.integration.worker']
+        worker_model._heartbeat(
+            self.uuid, self.name,
+            [app.application_id for app in self.applications.values() if app.active and app.leading]
         )
 
-        for obj in objects:
-            # Stopper could be suddenly set!
-            if self.stopper.is_set():
+        with self.lock:
+            claimed = list(self.claimed)
+
+        timeout = worker_timeout(env.cr)
+        data_model = env['application.integration.data']
+        requeued = data_model._requeue_jobs(timeout) + data_model._requeue_claims(self.uuid, claimed)
+        worker_model._expire(timeout)
+        env.cr.commit()
+
+        if requeued:
+            _logger.info('Application Integration scheduler %s: requeued %s orphaned jobs', self.name, len(requeued))
+
+    def unregister(self):
+        try:
+            with api.Environment.manage(), closing(self.new_db_cursor()) as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env['application.integration.worker']._unregister(self.uuid)
+                cr.commit()
+        except Exception as e:
+            _logger.warning('Application Integration scheduler %s: unregister failed: %s', self.name, e)
+
+    def next_timeout(self):
+        """Seconds until the next fallback poll or refresh"""
+        now = time.time()
+        free = self.pool_size - self.in_flight
+        deadlines = [self.next_refresh, self.next_heartbeat]
+        for app in self.applications.values():
+            if app.active and app.leading:
+                deadlines.append(app.next_poll)
+                if app.throttled(free):
+                    # Waiting for tokens only (busy workers wake us up)
+                    deadlines.append(now + app.throttle_delay())
+        return max(min(deadlines) - now, 0)
+
+    def wait(self, timeout):
+        """Wait until data gets ready (NOTIFY), an application gets started
+        or stopped, capacity becomes available or the scheduler is stopped
+        (wakeup), or the timeout (fallback poll) expires."""
+        deadline = time.time() + timeout
+
+        while not self.stopper.is_set():
+            remaining = deadline - time.time()
+            if remaining <= 0:
                 return
 
-            with closing(self.new_db_cursor()) as lock_cr:
-                lock_env = api.Environment(lock_cr, SUPERUSER_ID, {})
+            fds = [self._wakeup_r]
+            if self.listen_cr is not None:
+                fds.append(self.listen_cr._cnx)
 
+            readable = select.select(fds, [], [], remaining)[0]
+
+            if self._wakeup_r in readable:
                 try:
-                    lock_cr.execute(
-                        """
-                        SELECT
-                          id
-                        FROM
-                          application_integration_data
-                        WHERE
-                          id = %s
-                          AND state = 'ready'
-                        FOR UPDATE NOWAIT""" % obj.id,
-                        log_exceptions=False
-                    )
+                    os.read(self._wakeup_r, 512)
+                except OSError:
+                    pass
+                return
 
-                    locked_job = lock_cr.fetchone()
+            if readable:
+                conn = self.listen_cr._cnx
+                try:
+                    conn.poll()
+                except Exception as e:
+                    # Broken connection, LISTEN again on the next iteration
+                    _logger.warning('Application Integration scheduler %s: lost LISTEN connection: %s', self.name, e)
+                    self.unlisten()
+                    return
+
+                if conn.notifies:
+                    self.handle_notifies(conn.notifies)
+                    del conn.notifies[:]
+                    return
+
+    def handle_notifies(self, notifies):
+        for notify in notifies:
+            if notify.channel == CONTROL_CHANNEL:
+                self.refresh_needed = True
+                continue
+
+            for app in self.applications.values():
+                if app.active and app.leading and notify.channel == NOTIFY_CHANNEL % app.application_id:
+                    app.wake(self.virtual_time)
+
+    def refresh_applications(self, env):
+        """Synchronize the applications with the started (thread_uuid)
+        applications in the database."""
+        self.refresh_needed = False
+        self.next_refresh = time.time() + REFRESH_INTERVAL
+        # Record the processed applications right away
+        self.next_heartbeat = 0
+
+        app_objs = env['application.integration.application'].search([('thread_uuid', '!=', False)])
+
+        started = set()
+        for app_obj in app_objs:
+            app = self.applications.get(app_obj.id)
+
+            if app is None:
+                app = ScheduledApplication(app_obj.id)
+                app.pass_value = self.virtual_time
+                app.metrics = application_metrics(self.dbname, app_obj.id)
+                self.applications[app_obj.id] = app
+
+                _logger.info('Application Integration scheduler %s: starting %s (%s)', self.name, app_obj.name, app_obj.thread_uuid)
+            elif not app.active and app.thread_uuid != app_obj.thread_uuid:
+                # Restarted, after a stop
+                app.active = True
+                app.wake(self.virtual_time)
+                _logger.info('Application Integration scheduler %s: restarting %s (%s)', self.name, app_obj.name, app_obj.thread_uuid)
+
+            if app.active:
+                app.update(app_obj)
+                started.add(app_obj.id)
+
+        for app in self.applications.values():
+            if app.application_id not in started:
+                if app.active:
+                    _logger.info('Application Integration scheduler %s: stopping %s', self.name, app.name)
+                app.active = False
+
+            self.update_slot(app)
+            app.resize_process_pool()
+
+            if not app.active and not app.in_flight:
+                del self.applications[app.application_id]
+
+        max_size = int(env['ir.config_parameter'].get_param('application_integration.scheduler_workers', '16'))
+        self.resize_pool(min(sum(app.max_workers for app in self.applications.values() if app.active and app.leading), max_size))
+
+    def dispatch(self, env):
+        """Claim ready jobs and dispatch them to the workers, as long as a
+        worker is (about to be) idle. The application with the lowest pass
+        value (stride scheduling) goes first, so applications are served
+        proportionally to their priority weight and none starves."""
+        data_model = env['application.integration.data']
 
-                    if not locked_job:
-                        _logger.debug("Job `%s` already executed by another process/thread. skipping it", obj.id)
-                        continue
+        now = time.time()
+        for app in self.applications.values():
+            if app.active and app.leading and now >= app.next_poll:
+                app.wake(self.virtual_time)
+                app.next_poll = now + app.poll_interval
+
+        while not self.stopper.is_set():
+            free = self.pool_size - self.in_flight
+            if free <= 0:
+                return
+
+            candidates = []
+            for app in self.applications.values():
+                if app.active and app.leading and app.handler and app.has_work and app.in_flight < app.max_workers:
+                    # Backpressure: max. in flight and rate limit
+                    capacity = app.capacity()
+                    if capacity is None or capacity >= app.min_claim:
+                        candidates.append((app, capacity))
+            if not candidates:
+                return
 
-                    with closing(self.new_db_cursor()) as job_cr:
-                        try:
-                            job_env = api.Environment(job_cr, SUPERUSER_ID, {})
-
-                            _logger.info("Calling model.method: %s.%s" % (obj.application.model, obj.application.function))
-
-                            method_to_call = getattr(job_env[obj.application.model], obj.application.function)
-                            result = method_to_call(obj)
-
-                            if result[0]:
-                                obj.with_env(lock_env).write({'state': 'done', 'message': result[1]})
-                                job_cr.commit()
-                            else:
-                                obj.with_env(lock_env).write({'state': 'error', 'message': result[1]})
-                                job_cr.rollback()
-                        except Exception as e:
-                            if obj.application.function is not False or obj.application.model is not False:
-                                _logger.error("Error %s", e)
-                            else:
-                                _logger.error(
-                                    "Error calling %s: %s - %s" %
-                                    (obj.application.model + "." + obj.application.function, sys.exc_info()[0], sys.exc_info()[1])
-                                )
-
-                                obj.with_env(lock_env).write({'state': 'error'})
-                                job_cr.rollback()
-                        finally:
-                            lock_cr.commit()
-                except:
-                    _logger.info(("Error locking application.integration.data job: %s" % sys.exc_info()[1]))
+            app, capacity = min(candidates, key=lambda candidate: (candidate[0].pass_value, candidate[0].priority, candidate[0].application_id))
+            if app.dispatch_batches:
+                # One batch per worker
+                limit = app.batch_size
+            else:
+                limit = min(app.batch_size, app.max_workers - app.in_flight, free)
+            if capacity is not None:
+                limit = min(limit, capacity)
+
+            start = time.time()
+            jobs, waits, keyed_ids = data_model._claim_jobs(app.application_id, limit, self.uuid)
+            env.cr.commit()
+
+            app.metrics.observe('claim', time.time() - start)
+            for wait in waits:
+                app.metrics.observe('pickup', wait)
+
+            if len(jobs) < limit:
+                app.has_work = False
+
+            if app.bucket is not None:
+                app.bucket.take(len(jobs))
+
+            if jobs:
+                self.virtual_time = app.pass_value
+                app.pass_value += float(len(jobs)) / app.weight
+                self.dispatch_jobs(app, jobs, keyed_ids)
+
+    def resize_pool(self, size):
+        """Start or retire workers, until `size` workers are running"""
+        self.pool_size = size
+
+        with self.lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive() and not worker.abandoned]
+            active = len(self.workers) - self.retiring
+
+        while active < size:
+            worker = ApplicationWorker(
+                name='%s/worker-%s' % (self.name, self.worker_seq.next()),
+                scheduler=self
+            )
+            worker.setDaemon(True)
+            worker.start()
+            self.workers.append(worker)
+            active += 1
+
+        while active > size:
+            # Any (idle) worker retires, after the jobs already dispatched
+            with self.lock:
+                self.retiring += 1
+            self.queue.put(None)
+            active -= 1
+
+    def execute(self, app, job_ids):
+        """Process dispatched jobs, in this thread or a worker process"""
+        pool, handler = app.process_pool, app.handler
+
+        if handler is None:
+            # Misconfigured since the jobs got dispatched
+            self.release_jobs(job_ids)
+            return
+
+        if pool is None:
+            stats = self.processor.process(job_ids, handler)
+        else:
+            try:
+                result = pool.apply_async(_process_job_in_process, (self.dbname, self.uuid, job_ids, handler))
+            except ValueError:
+                # Pool closed (reconfigured or stopped) before the jobs got submitted
+                self.release_jobs(job_ids)
+                return
+
+            # The alarm of the worker process fails a job in time, unless
+            # the process hangs: then the pool is replaced
+            timeout = None
+            if handler.job_timeout:
+                jobs = 1 if handler.batch_method else len(job_ids)
+                timeout = handler.job_timeout * jobs + ABANDON_GRACE
+            try:
+                stats = result.get(timeout)
+            except multiprocessing.TimeoutError:
+                _logger.error('Application Integration %s: worker process hangs on data line(s) %s, '
+                              'terminating the worker processes', app.name, job_ids)
+                app.terminate_process_pool(pool)
+                self.request_refresh()
+
+                stats = JobStats()
+                stats.count(self.fail_jobs(job_ids, JobTimeout(timeout)))
+
+            if stats is None:
+                # Failed in the worker process (logged there)
+                self.release_jobs(job_ids)
+                return
+
+        app.metrics.add(stats)
+        app.adapt(stats.outcomes)
+
+    def stop_workers(self):
+        """Give back the dispatched, but not yet started jobs and let the
+        workers exit (after their current job)."""
+        items = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if item is not None:
+                items.append(item)
+
+        if items:
+            self.release_jobs([job_id for (app, job_ids) in items for job_id in job_ids])
+            for (app, job_ids) in items:
+                self.job_done(app, job_ids)
+
+        for worker in self.workers:
+            self.queue.put(None)
+
+    def join_workers(self, deadline):
+        """Wait (up to `deadline`) for the workers to finish their jobs.
+        Returns whether all did."""
+        for worker in list(self.workers):
+            worker.join(max(deadline - time.time(), 0))
+
+        busy = [worker for worker in self.workers if worker.is_alive() and not worker.abandoned]
+        if busy:
+            _logger.warning('Application Integration scheduler %s: %s jobs still in progress, giving up on them '
+                            '(requeued once their connections are gone)', self.name, len(busy))
+        return not busy
+
+    def fail_jobs(self, job_ids, error, release_ids=()):
+        """Fail the jobs still in processing (claimed by this scheduler) of
+        a job or batch given up on (e.g. timeout), and give back the jobs
+        `release_ids`. Returns the outcomes."""
+        outcomes = {}
+        try:
+            with api.Environment.manage(), closing(self.new_db_cursor()) as cr:
+                cr.execute(
+                    """
+                    SELECT
+                      id
+                    FROM
+                      application_integration_data
+                    WHERE
+                      id IN %s
+                      AND state = 'processing'
+                      AND claim_uuid = %s
+                    FOR UPDATE""",
+                    (tuple(job_ids), self.uuid)
+                )
+                ids = [id for (id,) in cr.fetchall()]
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                if ids:
+                    message = "%s" % error
+                    outcomes = env['application.integration.data'].browse(ids)._write_results(
+                        dict((id, (False, message)) for id in ids))
+
+                if release_ids:
+                    env['application.integration.data'].browse(list(release_ids))._release_jobs(self.uuid)
+                cr.commit()
+        except Exception:
+            _logger.exception('Application Integration scheduler %s: failed to fail data line(s) %s', self.name, job_ids)
+        return outcomes
+
+    def release_jobs(self, job_ids):
+        with api.Environment.manage(), closing(self.new_db_cursor()) as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            env['application.integration.data'].browse(job_ids)._release_jobs(self.uuid)
+            cr.commit()
+
+    def dispatch_jobs(self, app, jobs, keyed_ids=()):
+        """Queue the jobs for the workers: all at once for a batch method or
+        a transaction per batch, otherwise one by one"""
+        if app.dispatch_batches:
+            items = [(app, jobs.ids)]
+        else:
+            items = [(app, [job_id]) for job_id in jobs.ids]
+
+        with self.lock:
+            self.in_flight += len(items)
+            app.in_flight += len(items)
+            app.jobs_in_flight += len(jobs)
+            self.claimed.update(jobs.ids)
+            self.keyed.update(keyed_ids)
+
+        for item in items:
+            self.queue.put(item)
+
+    def abandon_worker(self, worker, outcomes):
+        """A worker stuck in a job beyond the job timeout: its job is done
+        (failed), and a new worker takes its place. The abandoned worker
+        exits if the job ever returns."""
+        app, job_ids = worker.item
+
+        stats = JobStats()
+        stats.count(outcomes)
+        app.metrics.add(stats)
+
+        self.job_done(app, job_ids)
+        # Starts the replacement (resize of the pool)
+        self.request_refresh()
+
+    def job_done(self, app, job_ids):
+        with self.lock:
+            self.in_flight -= 1
+            app.in_flight -= 1
+            app.jobs_in_flight -= len(job_ids)
+            self.claimed.difference_update(job_ids)
+
+            keyed = self.keyed.intersection(job_ids)
+            if keyed:
+                # The next line of the key may be claimed now (no NOTIFY)
+                self.keyed.difference_update(keyed)
+                app.has_work = True
+
+        if not app.active and not app.in_flight:
+            # Drained: release its slot
+            self.refresh_needed = True
+
+        # Capacity became available
+        self.wakeup()
+
+
+class JobWatch(object):
+    """A job (or batch) in its handler, in a worker thread"""
+
+    def __init__(self, worker, handler, job_ids, timeout, handler_pid, connections, batch_ids=None):
+        self.worker = worker
+        self.handler = handler
+        self.job_ids = job_ids
+        # All jobs of the transaction (savepoints), rolled back with it
+        self.batch_ids = batch_ids or job_ids
+        self.timeout = timeout
+        # Backend of the cursor of the handler (cancelled), and the
+        # connections of all cursors of the job: handler, row locks
+        # (terminated, and dropped from the pool)
+        self.handler_pid = handler_pid
+        self.connections = connections
+        self.pids = [cnx.get_backend_pid() for cnx in connections]
+        self.deadline = time.time() + timeout
+        self.cancelled = False
+        self.abandoned = False
+
+
+class JobWatchdog(threading.Thread):
+    """
+    Enforces the job timeouts in the worker threads of an Application
+    Scheduler: a job beyond its timeout gets its statement cancelled (so the
+    handler fails, as a timeout). A job still running after a grace period
+    (e.g. not in SQL) is abandoned: its connections are terminated, which
+    releases its row locks, it fails as a timeout and a new worker takes the
+    place of its worker.
+    """
+
+    def __init__(self, scheduler):
+        super(JobWatchdog, self).__init__(name='%s.watchdog' % scheduler.name)
+
+        self.scheduler = scheduler
+        self.watches = set()
+        self.lock = threading.Lock()
+        self.stopper = threading.Event()
+        self.cr = None
+
+    def watch(self, handler, job_ids, timeout, handler_cr, lock_cr, batch_ids=None):
+        connections = [handler_cr._cnx]
+        if lock_cr._cnx is not handler_cr._cnx:
+            connections.append(lock_cr._cnx)
+        watch = JobWatch(threading.current_thread(), handler, job_ids, timeout,
+                         handler_cr._cnx.get_backend_pid(), connections, batch_ids)
+        with self.lock:
+            self.watches.add(watch)
+        return watch
+
+    def unwatch(self, watch):
+        """The job returned (or raised). Returns whether it timed out."""
+        with self.lock:
+            self.watches.discard(watch)
+            return watch.cancelled or watch.abandoned
+
+    def run(self):
+        try:
+            while not self.stopper.wait(WATCHDOG_INTERVAL):
+                now = time.time()
+                with self.lock:
+                    expired = [watch for watch in self.watches if not watch.cancelled and now >= watch.deadline]
+                    stuck = [watch for watch in self.watches if watch.cancelled and now >= watch.deadline + ABANDON_GRACE]
+                    # Cancelled under the lock: the job cannot return (unwatch)
+                    # and go on with other statements in the meantime
+                    for watch in expired:
+                        watch.cancelled = True
+                        self.cancel(watch)
+                    for watch in stuck:
+                        self.watches.discard(watch)
+                        watch.abandoned = True
+                        watch.worker.abandoned = True
+
+                for watch in stuck:
+                    self.abandon(watch)
+        finally:
+            self.close()
+
+    def execute(self, query, params):
+        """Run a query in the (autocommit) connection of the watchdog"""
+        try:
+            if self.cr is None:
+                self.cr = sql_db.db_connect(self.scheduler.dbname).cursor()
+                self.cr.autocommit(True)
+            self.cr.execute(query, params)
+        except Exception as e:
+            _logger.error('Application Integration watchdog %s: %s', self.name, e)
+            self.close()
+
+    def close(self):
+        if self.cr is not None:
+            try:
+                self.cr.close()
+            except Exception:
+                pass
+            self.cr = None
+
+    def cancel(self, watch):
+        _logger.warning('Application Integration %s: timeout after %s seconds for data line(s) %s, cancelling',
+                        watch.handler, watch.timeout, watch.job_ids)
+        self.execute("SELECT pg_cancel_backend(%s)", (watch.handler_pid,))
+
+    def abandon(self, watch):
+        _logger.error('Application Integration %s: data line(s) %s still running %s seconds after the timeout, '
+                      'abandoning worker %s', watch.handler, watch.job_ids, ABANDON_GRACE, watch.worker.name)
+
+        # Rolls back the transactions of the job, releasing its row locks
+        self.execute("SELECT pg_terminate_backend(pid) FROM unnest(%s) AS pid", (watch.pids,))
+
+        # The cursors of the abandoned worker can never give back their
+        # (dead) connections: the rollback of their close fails. Drop them
+        # from the pool now, so their slots are not lost.
+        for cnx in watch.connections:
+            try:
+                sql_db._Pool.give_back(cnx, keep_in_pool=False)
+            except Exception as e:
+                _logger.warning('Application Integration watchdog %s: connection of an abandoned job not '
+                                'dropped from the pool: %s', self.name, e)
+
+        # The other jobs of its transaction (rolled back) are given back
+        other_ids = [id for id in watch.batch_ids if id not in watch.job_ids]
+        outcomes = self.scheduler.fail_jobs(watch.job_ids, JobTimeout(watch.timeout), other_ids)
+
+        self.scheduler.abandon_worker(watch.worker, outcomes)
+
+
+class ApplicationWorker(threading.Thread):
+    """
+    Application Worker, processes the jobs dispatched by the Application
+    Scheduler (for any application)
+    """
+
+    def __init__(self, name, scheduler):
+        super(ApplicationWorker, self).__init__(name=name)
+
+        self.scheduler = scheduler
+        self.item = None
+        # Stuck in a job beyond its timeout, replaced (see JobWatchdog)
+        self.abandoned = False
+
+    def run(self):
+        scheduler = self.scheduler
+
+        while True:
+            item = scheduler.queue.get()
+            if item is None:
+                with scheduler.lock:
+                    scheduler.retiring = max(scheduler.retiring - 1, 0)
+                return
+
+            app, job_ids = item
+            self.item = item
+            try:
+                # Stopped after dispatch, give the jobs back
+                if scheduler.stopper.is_set() or not app.active:
+                    scheduler.release_jobs(job_ids)
+                    continue
+
+                scheduler.execute(app, job_ids)
+            except Exception as e:
+                _logger.error('Application Integration worker %s: %s', self.name, e)
+            finally:
+                if not self.abandoned:
+                    scheduler.job_done(app, job_ids)
+
+            if self.abandoned:
+                _logger.warning('Application Integration worker %s: abandoned job returned, exiting', self.name)
+                return
+
+
+# Server shutdown: drain the schedulers while their (daemon) threads still run
+atexit.register(ApplicationScheduler.shutdown_all)
 
 
 class ApplicationIntegrationApplication(models.Model):
@@ -194,11 +1711,158 @@ class ApplicationIntegrationApplication(models.Model):
     )
     args = fields.Text(
         "Arguments",
-        help="Arguments to be passed to the method, e.g. (uid,)."
+        help="Extra arguments passed to the method (after the data line), as a Python literal: "
+             "a tuple of positional arguments, e.g. (1, 'EUR'), or a dict of keyword arguments, "
+             "e.g. {'lang': 'nl_NL'}."
     )
     priority = fields.Integer(
         "Priority",
-        help="The priority of the job, as an integer: 0 means higher priority, 10 means lower priority."
+        help="The priority of the job, as an integer: 0 means higher priority, 10 means lower priority. "
+             "Applications are served proportionally to their priority (priority 0 gets 11 times the "
+             "share of priority 10), so lower priorities don't starve."
+    )
+    batch_size = fields.Integer(
+        "Batch Size",
+        default=10,
+        help="Maximum number of ready data lines claimed at once by the scheduler."
+    )
+    max_workers = fields.Integer(
+        "Workers",
+        default=1,
+        help="Maximum number of data lines processed concurrently (by the workers of the scheduler)."
+    )
+    max_nodes = fields.Integer(
+        "Nodes",
+        default=1,
+        help="Maximum number of Odoo processes (nodes, workers) processing the application at once, "
+             "each with its own workers. With 1 a single scheduler leads the application (another one "
+             "takes over when it stops or dies), so its rate limit holds for the cluster."
+    )
+    worker_ids = fields.Many2many(
+        'application.integration.worker',
+        'application_integration_worker_application_rel',
+        'application_id',
+        'worker_id',
+        "Processed By",
+        readonly=True
+    )
+    job_timeout = fields.Integer(
+        "Job Timeout",
+        default=0,
+        help="Seconds a data line (or batch) may take in the method. Beyond, its SQL gets cancelled and it "
+             "fails (and is retried, as far as the attempts allow); if it still does not return, its worker "
+             "is replaced. 0 means no timeout."
+    )
+    slow_job_threshold = fields.Integer(
+        "Slow Job Threshold",
+        default=60,
+        help="Data lines (or batches) taking at least this many seconds in the method are logged as slow jobs "
+             "(logger openerp.addons.application_integration.models.application_integration.slow). "
+             "0 means not logged."
+    )
+    max_in_flight = fields.Integer(
+        "Max. In Flight",
+        default=0,
+        help="Maximum number of data lines claimed and not yet processed (queued for or in a worker). "
+             "0 means no limit (but the workers)."
+    )
+    rate_limit = fields.Float(
+        "Rate Limit",
+        default=0,
+        help="Maximum number of data lines started per second (token bucket), e.g. the request quota "
+             "of the API the method calls. 0 means no limit. Applies per Odoo process."
+    )
+    rate_burst = fields.Integer(
+        "Rate Burst",
+        default=0,
+        help="Data lines that may start at once (bucket size), after being idle. "
+             "0 means a second worth of the rate limit."
+    )
+    adaptive_rate = fields.Boolean(
+        "Adaptive Rate",
+        default=False,
+        help="Checked means the rate is halved (down to 1/64 of the limit) after failed data lines, "
+             "and recovers by a tenth of the limit after every successful one (or batch)."
+    )
+    batch_method = fields.Boolean(
+        "Batch Method",
+        default=False,
+        help="Checked means the method is called once for (up to) Batch Size data lines, with a recordset, "
+             "and returns a result per line: a dict {id: [ok, message]} or a list of [ok, message] "
+             "in order of the lines."
+    )
+    execution_mode = fields.Selection(
+        [
+            ('thread', 'Thread'),
+            ('process', 'Process')
+        ],
+        string="Execution Mode",
+        default='thread',
+        required=True,
+        help="Thread: the method is called in the worker threads of this Odoo process.\n"
+             "Process: the method is called in a pool of worker processes (one per worker), "
+             "for CPU-bound methods which would otherwise hold the GIL."
+    )
+    transaction_mode = fields.Selection(
+        [
+            ('job', 'Per Job'),
+            ('batch', 'Per Batch')
+        ],
+        string="Transaction Mode",
+        default='job',
+        required=True,
+        help="Per Job: every data line is processed and committed on its own (the changes of the method "
+             "separately from the state of the line).\n"
+             "Per Batch: a worker processes (up to) Batch Size data lines on one connection, each in a "
+             "savepoint, and commits the changes of the method with the states of the lines at once."
+    )
+    max_attempts = fields.Integer(
+        "Max. Attempts",
+        default=1,
+        help="Number of times a data line is processed before it fails for good. Above 1, a failed line "
+             "gets ready again after the retry delay, and goes to dead letter when its attempts are exhausted."
+    )
+    retry_delay = fields.Integer(
+        "Retry Delay",
+        default=60,
+        help="Seconds before the first retry of a failed data line, doubled for every next retry "
+             "(retries are picked up by the next poll at the latest)."
+    )
+    retry_jitter = fields.Float(
+        "Retry Jitter",
+        default=0.1,
+        help="Random extra delay, as a fraction of the retry delay (e.g. 0.1 is up to 10%), "
+             "so lines failed at the same time are not all retried at once."
+    )
+    profile_mode = fields.Selection(
+        [
+            ('off', 'Off'),
+            ('sample', 'Sampled'),
+            ('threshold', 'Slow Jobs')
+        ],
+        string="Profiling",
+        default='off',
+        required=True,
+        help="Profiles of the method (cProfile, SQL queries and time, memory delta with psutil), shown below.\n"
+             "Sampled: a random fraction (Sample Rate) of the data lines (or batches) is profiled.\n"
+             "Slow Jobs: every call is profiled (overhead!), the profile is kept when it took at least "
+             "the Slow Job Threshold (none without threshold)."
+    )
+    profile_sample_rate = fields.Float(
+        "Sample Rate",
+        default=0.01,
+        help="Fraction of the data lines (or batches) profiled, e.g. 0.01 is 1%."
+    )
+    profile_ids = fields.One2many(
+        'application.integration.profile',
+        'application',
+        "Profiles",
+        readonly=True
+    )
+    split_tag = fields.Char(
+        "Split Tag",
+        help="Record element of XML files (create_from_file): each element becomes a data line, "
+             "e.g. 'Article', '{namespace}Article' or 'Articles/Article'."
     )
     checkpoint = fields.Boolean(
         "Checkpoint",
@@ -214,6 +1878,42 @@ class ApplicationIntegrationApplication(models.Model):
         default=False,
         help="Ensures the application(thread) will be started right after Odoo starts"
     )
+    poll_interval = fields.Integer(
+        "Poll Interval",
+        default=60,
+        help="Seconds between fallback polls for ready data. The scheduler is woken up "
+             "immediately (PostgreSQL NOTIFY) whenever data is set ready for processing."
+    )
+    retention_days = fields.Integer(
+        "Retention (days)",
+        default=0,
+        help="Done and cancelled data lines are archived or deleted (daily) once unchanged "
+             "for this many days. 0 keeps them forever."
+    )
+    deduplicate_content = fields.Boolean(
+        "Deduplicate Content",
+        default=False,
+        help="Checked means a data line without idempotency key is not created again when a line with the "
+             "same data (content hash) exists within the dedupe window: the existing line is returned. "
+             "Lines with an idempotency key are always deduplicated by their key."
+    )
+    dedupe_window = fields.Integer(
+        "Dedupe Window (hours)",
+        default=24,
+        help="Hours a data line counts as the original of later lines with its idempotency key (or data). "
+             "Older lines lose their key and hash once such a line comes in. 0 means forever."
+    )
+    retention_mode = fields.Selection(
+        [
+            ('archive', 'Archive'),
+            ('delete', 'Delete')
+        ],
+        string="After Retention",
+        default='archive',
+        required=True,
+        help="Archive: the data lines are moved to the archive (without their messages and "
+             "attachments). Delete: the data lines are deleted."
+    )
 
     _sql_constraints = [
         ('name_uniq', 'unique (name)', 'The name of asset must be unique!'),
@@ -224,10 +1924,29 @@ class ApplicationIntegrationApplication(models.Model):
         self._autostart_application_threads(pool, cr)
         return res
 
+    @api.multi
+    def _handler(self):
+        """The validated ApplicationHandler of the application"""
+        self.ensure_one()
+        try:
+            handler = ApplicationHandler.from_application(self)
+            handler.validate(self.env)
+        except ValueError as e:
+            raise exceptions.ValidationError("Application %s: %s" % (self.name, e))
+        return handler
+
+    @api.constrains('model', 'function', 'args')
+    def _check_handler(self):
+        for app in self:
+            app._handler()
+
     @api.multi
     def start_application_thread(self, context=None, *args, **kwargs):
         """Start application thread (button method)"""
 
+        # Misconfigured: fail right away, instead of for every job
+        self._handler()
+
         try:
             uuid = self._thread_uuid()
             self.thread_uuid = uuid
@@ -242,61 +1961,148 @@ class ApplicationIntegrationApplication(models.Model):
             _logger.error('Exception: %s' % e)
 
     def _start_application_thread(self, thread_uuid, application_id, dbname):
-        """Start application thread (thread handler)"""
-
-        stopper = threading.Event()
+        """Start application thread (thread handler): the application gets
+        dispatched by the scheduler of the database, as from its (next)
+        refresh."""
 
         try:
-            t = ApplicationThread(
-                name=thread_uuid,
-                application_id=application_id,
-                dbname=dbname,
-                stopper=stopper
-            )
+            scheduler = ApplicationScheduler.ensure_started(dbname, self.pool)
         except Exception as e:
             _logger.critical("Exception _start_application_thread: %s" % e)
             return
 
         _logger.info('Starting Application Integration thread: %s', thread_uuid)
-        t.setDaemon(True)
-        t.start()
+        scheduler.request_refresh()
 
     @api.multi
     def stop_application_thread(self, context=None, *args, **kwargs):
         """Stop application thread (button method)"""
 
-        self._stop_application_thread(self.thread_uuid)
+        # Stops the claims of all nodes (notified on commit), then drains
+        thread_uuid = self.thread_uuid
         self.thread_uuid = None
         self._cr.commit()
 
-    def _stop_application_thread(self, thread_uuid):
-        """Stop application thread (thread handler)"""
+        self._stop_application_thread(thread_uuid, DRAIN_TIMEOUT)
+
+    def _stop_application_thread(self, thread_uuid, timeout=0):
+        """Stop application thread (thread handler): no new claims, and wait
+        up to `timeout` seconds for the jobs in progress (in this process)."""
 
-        for thread in threading.enumerate():
-            if thread.getName() == thread_uuid:
-                thread.stopper.set()
-                _logger.info("Stopping Application Integration thread: %s", thread_uuid)
-                # thread.join()  # TODO Needed?
+        if not thread_uuid:
+            return
+
+        _logger.info("Stopping Application Integration thread: %s", thread_uuid)
+        if not ApplicationScheduler.stop_application(thread_uuid, timeout) and timeout:
+            _logger.warning("Application Integration thread %s: jobs still in progress after %s seconds", thread_uuid, timeout)
 
     def is_thread_alive(self):
         if not self.thread_uuid:
             return False
 
-        for thread in threading.enumerate():
-            if thread.getName() == self.thread_uuid:
-                return thread.is_alive()
+        # Processed by a live scheduler of any node, or still processing jobs
+        scheduler = ApplicationScheduler.get(self._cr.dbname)
+        if scheduler is not None and scheduler.is_application_alive(self.thread_uuid):
+            return True
+        return self.env['application.integration.worker']._is_processing(self.id)
 
-        return False
+    @api.multi
+    def write(self, vals):
+        res = super(ApplicationIntegrationApplication, self).write(vals)
+        self._notify_schedulers()
+        return res
+
+    @api.multi
+    def unlink(self):
+        if self.ids:
+            self.env['application.integration.data.archive']._delete_application_archives(self.ids)
+        res = super(ApplicationIntegrationApplication, self).unlink()
+        self._notify_schedulers()
+        return res
+
+    @api.model
+    def _cron_purge_data(self):
+        """Retention (scheduled action): archive or delete the expired data
+        lines of all applications, then drop the expired archives and
+        profiles."""
+        for app in self.search([('retention_days', '>', 0)]):
+            try:
+                app._purge_data()
+            except Exception:
+                self._cr.rollback()
+                _logger.exception("Retention of application %s failed", app.name)
+
+        self.env['application.integration.data.archive']._expire_archives()
+        self.env['application.integration.profile']._expire()
+
+    @api.multi
+    def _purge_data(self, chunk_size=RETENTION_CHUNK):
+        """Archive (or delete) the done and cancelled data lines unchanged
+        for more than `retention_days`, a chunk per transaction, so the
+        locks and the WAL of every transaction stay bounded."""
+        self.ensure_one()
+
+        data_model = self.env['application.integration.data']
+        archive_model = self.env['application.integration.data.archive']
+        att_model = self.env['ir.attachment']
+        expiry = (datetime.utcnow() - timedelta(days=self.retention_days)).strftime(DEFAULT_SERVER_DATETIME_FORMAT)
+
+        count = 0
+        while True:
+            self._cr.execute(
+                """
+                SELECT
+                  id
+                FROM
+                  application_integration_data
+                WHERE
+                  application = %s
+                  AND state IN ('done', 'cancel')
+                  AND write_date < %s
+                ORDER BY
+                  write_date
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED""",
+                (self.id, expiry, chunk_size)
+            )
+            ids = [id for (id,) in self._cr.fetchall()]
+            if not ids:
+                break
+
+            if self.retention_mode == 'archive':
+                archive_model._archive(ids)
+            fnames = data_model._purge(ids)
+            self._cr.commit()
+
+            # Stored files only go once their rows are gone for good
+            for fname in fnames:
+                att_model._file_delete(fname)
+
+            count += len(ids)
+
+        if count:
+            _logger.info("Retention of application %s: %s data lines %s", self.name, count,
+                         'archived' if self.retention_mode == 'archive' else 'deleted')
+        return count
+
+    def _notify_schedulers(self):
+        """Let the schedulers (of all processes) refresh the started
+        applications. Delivered on commit of this transaction."""
+        self._cr.execute("SELECT pg_notify(%s, '')", (CONTROL_CHANNEL,))
 
     def _autostart_application_threads(self, pool, cr):
         """These (last resort) SQL could led to API-change breakage.  However,
         currently funky errors with ORM search/reads on
         odoo.api.Environment.
         """
-        if not self._is_installed(pool, cr):
+        if _worker_process or not self._is_installed(pool, cr):
             return
 
         try:
+            # Joining running nodes (live schedulers): their started
+            # applications stay started
+            joining = self._cluster_alive(cr)
+
             cr.execute(
                 "SELECT "
                 "    id, "
@@ -307,9 +2113,14 @@ class ApplicationIntegrationApplication(models.Model):
             )
 
             for (id, autostart, uuid) in cr.fetchall():
-                # Stop
-                self._stop_application_thread(uuid)
-                cr.execute("UPDATE application_integration_application SET thread_uuid = NULL WHERE id = %s", (id,))
+                if joining:
+                    if uuid:
+                        ApplicationScheduler.ensure_started(cr.dbname, pool)
+                        continue
+                else:
+                    # Stop
+                    self._stop_application_thread(uuid)
+                    cr.execute("UPDATE application_integration_application SET thread_uuid = NULL WHERE id = %s", (id,))
 
                 # Start
                 if autostart:
@@ -317,11 +2128,25 @@ class ApplicationIntegrationApplication(models.Model):
                     self._start_application_thread(new_uuid, id, cr.dbname)
                     cr.execute("UPDATE application_integration_application SET thread_uuid = %s WHERE id = %s", (str(new_uuid), id))
 
+            cr.execute("SELECT pg_notify(%s, '')", (CONTROL_CHANNEL,))
+
         except Exception, e:
             _logger.error("Exception: %s" % e)
 
+    def _cluster_alive(self, cr):
+        """Whether a scheduler (of any node) has a recent heartbeat"""
+        cr.execute("SELECT 1 FROM pg_class WHERE relname = 'application_integration_worker'")
+        if not cr.fetchone():
+            return False
+
+        cr.execute(
+            "SELECT 1 FROM application_integration_worker "
+            " WHERE heartbeat >= (now() at time zone 'UTC') - %s * interval '1 second' LIMIT 1",
+            (worker_timeout(cr),)
+        )
+        return cr.fetchone() is not None
+
     def _thread_uuid(self):
-        from uuid import uuid4
         return uuid4()
 
     def _is_installed(self, pool, cr):
@@ -353,30 +2178,211 @@ class ApplicationIntegrationData(models.Model):
             ('draft', 'Draft'),
             ('cancel', 'Cancelled'),
             ('ready', 'Ready for processing'),
+            ('processing', 'Processing'),
             ('done', 'Done'),
-            ('error', 'Error')
+            ('error', 'Error'),
+            ('dead', 'Dead letter')
         ],
         string="State",
         readonly=True
     )
+    priority = fields.Integer(
+        "Priority",
+        default=5,
+        help="The priority of the job, as an integer: 0 means higher priority, 10 means lower priority."
+    )
+    partition_key = fields.Char(
+        "Partition Key",
+        help="Data lines with the same partition key (e.g. the entity they change) are processed in order "
+             "(FIFO), one at a time; lines of different keys in parallel. Empty: no ordering."
+    )
+    idempotency_key = fields.Char(
+        "Idempotency Key",
+        copy=False,
+        help="Key of the message given by the producer: a data line is not created again for a key of its "
+             "application within the dedupe window, the existing line is returned instead."
+    )
+    data_hash = fields.Char(
+        "Data Hash",
+        readonly=True,
+        copy=False,
+        help="Content hash of the data as received (applications deduplicating content)."
+    )
+    profile_ids = fields.Many2many(
+        'application.integration.profile',
+        'application_integration_profile_data_rel',
+        'data_id',
+        'profile_id',
+        "Profiles",
+        readonly=True,
+        copy=False
+    )
+    attempt_count = fields.Integer(
+        "Attempts",
+        default=0,
+        readonly=True,
+        copy=False
+    )
+    next_attempt_at = fields.Datetime(
+        "Next Attempt",
+        readonly=True,
+        copy=False,
+        help="A failed line is not retried before this time."
+    )
+    claim_uuid = fields.Char(
+        "UUID (claimed by thread)",
+        readonly=True,
+        copy=False
+    )
+    # A copy gets the data (decompressed), packed again by the inverse: the
+    # storage columns are not copied, the payload column is unknown to the ORM
     data = fields.Text(
-        "Data"
+        "Data",
+        compute='_compute_data',
+        inverse='_inverse_data',
+        copy=True
+    )
+    data_inline = fields.Text(
+        "Data (inline)",
+        readonly=True,
+        copy=False
+    )
+    data_codec = fields.Selection(
+        [
+            ('zlib', 'zlib'),
+            ('zstd', 'zstd')
+        ],
+        string="Compression",
+        readonly=True,
+        copy=False
+    )
+    data_size = fields.Integer(
+        "Data Size",
+        readonly=True,
+        copy=False,
+        help="Size of the data in bytes"
+    )
+    data_preview = fields.Char(
+        "Data Preview",
+        readonly=True,
+        copy=False
     )
     message = fields.Text(
         'Processing Message'
     )
     pretty_data = fields.Text(
         'Pretty Data',
-        _compute='_make_data_pretty'
+        compute='_make_data_pretty'
     )
 
-    @api.one
-    def _make_data_pretty(self, id=None):
-        try:
-            x = etree.fromstring(self.data)
-            self.pretty_data = etree.tostring(x, pretty_print=True)
-        except:
-            self.pretty_data = self.data
+    @api.multi
+    @api.depends('data')
+    def _make_data_pretty(self):
+        """Pretty print the data (XML or JSON). Cached (per process) until
+        the data line changes, bounded in size."""
+        max_size = int(self.env['ir.config_parameter'].get_param(
+            'application_integration.pretty_max_size', PRETTY_MAX_SIZE))
+
+        for record in self:
+            key = (self._cr.dbname, record.id, record.write_date)
+            pretty = _pretty_cache.get(key)
+
+            if pretty is None:
+                pretty = prettify_payload(record.data, record.data_size, max_size)
+                if isinstance(record.id, (int, long)):
+                    _pretty_cache[key] = pretty
+
+            record.pretty_data = pretty
+
+    # Partial indexes of the (small) queues, so the lookups do not depend
+    # on the size of the history (the done rows), and of the history for
+    # the retention: name, columns, predicate
+    _partial_indexes = [
+        ('application_integration_data_ready_index', 'application, priority, id, next_attempt_at', "state = 'ready'"),
+        ('application_integration_data_processing_index', 'application, claim_uuid', "state = 'processing'"),
+        ('application_integration_data_history_index', 'application, write_date', "state IN ('done', 'cancel')"),
+        ('application_integration_data_partition_index', 'application, partition_key, id',
+         "state IN ('ready', 'processing') AND partition_key IS NOT NULL"),
+    ]
+
+    # Unique partial indexes of the deduplication, per application
+    _unique_indexes = [
+        ('application_integration_data_idempotency_index', 'application, idempotency_key',
+         "idempotency_key IS NOT NULL"),
+        ('application_integration_data_hash_index', 'application, data_hash', "data_hash IS NOT NULL"),
+    ]
+
+    def init(self, cr):
+        """Compressed payloads: bytea column, unknown to the ORM. And the
+        partial indexes of the queues, history and deduplication."""
+        cr.execute(
+            "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'payload'",
+            (self._table,)
+        )
+        if not cr.fetchone():
+            cr.execute('ALTER TABLE application_integration_data ADD COLUMN payload bytea')
+
+        for (unique, indexes) in ((False, self._partial_indexes), (True, self._unique_indexes)):
+            for (name, columns, predicate) in indexes:
+                cr.execute("SELECT 1 FROM pg_indexes WHERE indexname = %s", (name,))
+                if not cr.fetchone():
+                    _logger.info('Creating index %s', name)
+                    cr.execute('CREATE %sINDEX %s ON %s (%s) WHERE %s' % (
+                        'UNIQUE ' if unique else '', name, self._table, columns, predicate))
+
+    @api.multi
+    def _compute_data(self):
+        """Decompress the payloads, only when the data is actually read"""
+        ids = [id for id in self.ids if isinstance(id, (int, long))]
+
+        payloads = {}
+        if ids:
+            self._cr.execute(
+                "SELECT id, data_inline, payload, data_codec FROM application_integration_data WHERE id IN %s",
+                (tuple(ids),)
+            )
+            for (id, inline, payload, codec) in self._cr.fetchall():
+                payloads[id] = unpack_payload(inline, payload, codec)
+
+        for record in self:
+            record.data = payloads.get(record.id, False)
+
+    @api.multi
+    def _inverse_data(self):
+        threshold, codec = self._payload_settings()
+
+        for record in self:
+            self._cr.execute(
+                """
+                UPDATE
+                  application_integration_data
+                SET
+                  data_inline = %s,
+                  payload = %s,
+                  data_codec = %s,
+                  data_size = %s,
+                  data_preview = %s
+                WHERE
+                  id = %s""",
+                pack_payload(record.data, threshold, codec) + (record.id,)
+            )
+
+            # Changed within the transaction of a cached pretty print: same
+            # write_date (now()), thus the same key
+            try:
+                del _pretty_cache[(self._cr.dbname, record.id, record.write_date)]
+            except KeyError:
+                pass
+
+        self.invalidate_cache(['data_inline', 'data_codec', 'data_size', 'data_preview'], self.ids)
+
+    @api.model
+    def _payload_settings(self):
+        """Size threshold and codec of compressed payloads"""
+        params = self.env['ir.config_parameter']
+        threshold = int(params.get_param('application_integration.payload_threshold', PAYLOAD_THRESHOLD))
+        codec = params.get_param('application_integration.payload_codec', 'zlib')
+        return threshold, codec
 
     @api.multi
     def _attachfile(self, vals):
@@ -391,17 +2397,679 @@ class ApplicationIntegrationData(models.Model):
 
     @api.model
     def create(self, vals):
-        res = super(ApplicationIntegrationData, self).create(vals)
+        """Create a data line, or return the existing one with the same
+        idempotency key (or data) within the dedupe window."""
+        dedupe_key = None
+        if vals.get('application'):
+            application = self.env['application.integration.application'].browse(vals['application'])
+            dedupe_key = self._dedupe_key(vals, application.deduplicate_content)
+
+        if dedupe_key is None:
+            res = super(ApplicationIntegrationData, self).create(vals)
+        else:
+            existing = self._find_duplicates([dedupe_key])
+            if dedupe_key in existing:
+                return self.browse(existing[dedupe_key])
+
+            try:
+                with self._cr.savepoint():
+                    res = super(ApplicationIntegrationData, self).create(dict(vals, data_hash=dedupe_key[2]))
+            except psycopg2.IntegrityError:
+                # Created concurrently
+                existing = self._find_duplicates([dedupe_key])
+                if dedupe_key not in existing:
+                    raise
+                return self.browse(existing[dedupe_key])
+
         if vals.get('file') is not None:
             vals['res_id'] = res
             self._attachfile(vals)
+        if vals.get('state') == 'ready':
+            res._notify_ready()
         return res
 
+    @api.multi
+    def write(self, vals):
+        if vals.get('state') == 'ready':
+            # (Manually) ready again: a new series of attempts
+            vals = dict(vals)
+            vals.setdefault('attempt_count', 0)
+            vals.setdefault('next_attempt_at', False)
+
+        res = super(ApplicationIntegrationData, self).write(vals)
+        if vals.get('state') == 'ready':
+            self._notify_ready()
+        return res
+
+    @api.model
+    def _dedupe_key(self, vals, content):
+        """(application, idempotency key, data hash) of the data line `vals`,
+        the hash only without key and when deduplicating `content`. None
+        without either."""
+        key = vals.get('idempotency_key') or None
+        data_hash = None
+        if not key and content and vals.get('data'):
+            data_hash = payload_hash(vals['data'])
+
+        if key is None and data_hash is None:
+            return None
+        return (vals['application'], key, data_hash)
+
+    @api.model
+    def _find_duplicates(self, dedupe_keys):
+        """Existing data lines by their dedupe keys [(application, key,
+        hash)], within the dedupe window of their application. Older lines
+        with these keys lose them (they are no duplicates any more), so a
+        new line with the key can be created. Returns {dedupe key: id}."""
+        by_application = {}
+        for (application_id, key, data_hash) in dedupe_keys:
+            keys, hashes = by_application.setdefault(application_id, (set(), set()))
+            if key is not None:
+                keys.add(key)
+            else:
+                hashes.add(data_hash)
+
+        found = {}
+        for application_id, (keys, hashes) in by_application.items():
+            params = (application_id, list(keys), list(hashes))
+            self._cr.execute(
+                """
+                UPDATE
+                  application_integration_data AS data
+                SET
+                  idempotency_key = NULL,
+                  data_hash = NULL
+                FROM
+                  application_integration_application AS app
+                WHERE
+                  app.id = data.application
+                  AND data.application = %s
+                  AND (data.idempotency_key = ANY(%s) OR data.data_hash = ANY(%s))
+                  AND app.dedupe_window > 0
+                  AND data.create_date < (now() at time zone 'UTC') - app.dedupe_window * interval '1 hour'""",
+                params
+            )
+            self._cr.execute(
+                """
+                SELECT
+                  id, idempotency_key, data_hash
+                FROM
+                  application_integration_data
+                WHERE
+                  application = %s
+                  AND (idempotency_key = ANY(%s) OR data_hash = ANY(%s))""",
+                params
+            )
+            for (id, key, data_hash) in self._cr.fetchall():
+                found[(application_id, key, data_hash)] = id
+        return found
+
+    @api.model
+    def _transition(self, ids, state, note=None):
+        """Set the data lines `ids` to `state` in one statement, as far as
+        their current state allows (TRANSITIONS), with `note` in the chatter
+        of each changed line (inserted at once). Returns the changed ids.
+
+        Requires write access to the lines, like write() does."""
+        if not ids:
+            return []
+
+        self.check_access_rights('write')
+        self.browse(ids).check_access_rule('write')
+
+        extra = ""
+        if state == 'ready':
+            # A new series of attempts
+            extra = ", attempt_count = 0, next_attempt_at = NULL"
+
+        self._cr.execute(
+            """
+            UPDATE
+              application_integration_data
+            SET
+              state = %s,
+              claim_uuid = NULL,
+              write_uid = %s,
+              write_date = (now() at time zone 'UTC')""" + extra + """
+            WHERE
+              id IN %s
+              AND state IN %s
+            RETURNING
+              id""",
+            (state, self._uid, tuple(ids), TRANSITIONS[state])
+        )
+        changed = [id for (id,) in self._cr.fetchall()]
+        if not changed:
+            return changed
+
+        self.invalidate_cache(ids=changed)
+        if state == 'ready':
+            self.browse(changed)._notify_ready()
+
+        if note:
+            subtype = self.env.ref('mail.mt_note', raise_if_not_found=False)
+            self._cr.execute(
+                """
+                INSERT INTO mail_message
+                  (model, res_id, body, type, subtype_id, author_id, date,
+                   create_uid, create_date, write_uid, write_date)
+                SELECT
+                  %s, id, %s, 'notification', %s, %s, (now() at time zone 'UTC'),
+                  %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC')
+                FROM
+                  unnest(%s) AS id""",
+                (self._name, plaintext2html(note), subtype.id if subtype else None,
+                 self.env.user.partner_id.id, self._uid, self._uid, changed)
+            )
+        return changed
+
+    @api.model
+    def create_batch(self, vals_list, ready=False, tracking=False):
+        """Create data lines in bulk (e.g. over RPC), returns their ids.
+
+        The lines (and their 'file' attachments) are inserted with
+        multi-row INSERTs, without chatter (followers, creation message),
+        unless `tracking` is set. With `ready` all lines are created ready
+        for processing, followed by one wakeup per application. Duplicates
+        (idempotency key, data) are not inserted: their existing ids are
+        returned.
+        """
+        if tracking:
+            records = self.browse()
+            for vals in vals_list:
+                if ready:
+                    vals = dict(vals, state='ready')
+                records |= self.create(vals)
+            return records.ids
+
+        self.check_access_rights('create')
+
+        ids = []
+        for chunk in split_every(INSERT_BATCH_SIZE, vals_list):
+            ids.extend(self._insert_batch(list(chunk), ready))
+
+        ready_ids = [id for (id, vals) in zip(ids, vals_list) if ready or vals.get('state') == 'ready']
+        self.browse(ready_ids)._notify_ready()
+        return ids
+
+    @api.model
+    def create_from_file(self, application_id, file, filename=None, ready=True):
+        """Split a (base64) XML file into data lines (e.g. over RPC), one
+        per record element of the application's Split Tag, returns their
+        ids.
+
+        The file is parsed incrementally (iterparse), clearing every
+        processed element, and the lines are inserted in bulk.
+        """
+        self.check_access_rights('create')
+
+        application = self.env['application.integration.application'].browse(application_id)
+        if not application.split_tag:
+            raise exceptions.ValidationError("Application %s has no Split Tag" % application.name)
+
+        ids = []
+        with tempfile.TemporaryFile() as xmlfile:
+            base64.decode(StringIO(file), xmlfile)
+            xmlfile.seek(0)
+
+            vals_list = []
+            for data in self._iter_split(xmlfile, application.split_tag):
+                vals_list.append({'application': application_id, 'data': data})
+
+                if len(vals_list) >= INSERT_BATCH_SIZE:
+                    ids.extend(self._insert_batch(vals_list, ready))
+                    vals_list = []
+
+            if vals_list:
+                ids.extend(self._insert_batch(vals_list, ready))
+
+        _logger.info('Application Integration %s: split %s into %s data lines', application.name, filename or 'file', len(ids))
+
+        if ready and ids:
+            self.browse(ids[:1])._notify_ready()
+        return ids
+
+    def _iter_split(self, xmlfile, split_tag):
+        """Yield the record elements (serialized) of an XML file. The split
+        tag is an element tag ('Article', '{namespace}Article') or a path of
+        tags ('Articles/Article'), from the root or any ancestor."""
+        path = re.findall(r'\{[^}]*\}[^/]+|[^/]+', split_tag)
+
+        for event, elem in etree.iterparse(xmlfile, events=('end',), tag=path[-1], resolve_entities=False):
+            if self._match_ancestors(elem, path[:-1]):
+                yield etree.tostring(elem)
+
+                # Free the memory of the processed elements
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+    def _match_ancestors(self, elem, tags):
+        parent = elem.getparent()
+        for tag in reversed(tags):
+            if parent is None or parent.tag != tag:
+                return False
+            parent = parent.getparent()
+        return True
+
+    @api.model
+    def _insert_batch(self, vals_list, ready=False):
+        """Multi-row INSERT of data lines (and attachments), returns the ids
+        in order of `vals_list`. Duplicates, of existing lines or earlier in
+        `vals_list`, get the id of the original."""
+        cr = self._cr
+        states = [key for (key, label) in self._fields['state'].selection if key != 'processing']
+        threshold, codec = self._payload_settings()
+
+        application_ids = set(vals.get('application') for vals in vals_list if vals.get('application'))
+        content_ids = set(self.env['application.integration.application'].browse(
+            list(application_ids)).filtered('deduplicate_content').ids)
+
+        rows, dedupe_keys = [], []
+        for vals in vals_list:
+            unknown = set(vals) - BATCH_FIELDS
+            if unknown:
+                raise exceptions.ValidationError("Unsupported field(s) for create_batch: %s" % ', '.join(sorted(unknown)))
+            if not vals.get('application'):
+                raise exceptions.ValidationError("Application is required for each data line")
+
+            state = 'ready' if ready else vals.get('state')
+            if state and state not in states:
+                raise exceptions.ValidationError("Invalid state for create_batch: %s" % state)
+
+            dedupe_key = self._dedupe_key(vals, vals['application'] in content_ids)
+            dedupe_keys.append(dedupe_key)
+
+            rows.append((
+                vals['application'],
+                state or None,
+            ) + pack_payload(vals.get('data'), threshold, codec) + (
+                vals.get('message') or None,
+                vals.get('priority', 5),
+                vals.get('partition_key') or None,
+                dedupe_key and dedupe_key[1],
+                dedupe_key and dedupe_key[2],
+                self._uid,
+                self._uid
+            ))
+
+        # Duplicates of existing lines get their ids, of earlier lines in
+        # the batch the ids of those (once inserted)
+        ids = [None] * len(rows)
+        existing = self._find_duplicates([key for key in dedupe_keys if key is not None])
+        originals, inserts = {}, []
+        for index, dedupe_key in enumerate(dedupe_keys):
+            if dedupe_key is None:
+                inserts.append(index)
+            elif dedupe_key in existing:
+                ids[index] = existing[dedupe_key]
+            elif dedupe_key not in originals:
+                originals[dedupe_key] = index
+                inserts.append(index)
+
+        if inserts:
+            values = ', '.join(
+                cr.mogrify(
+                    "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, "
+                    "(now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))",
+                    rows[index]
+                )
+                for index in inserts
+            )
+            cr.execute(
+                """
+                INSERT INTO application_integration_data
+                  (application, state, data_inline, payload, data_codec, data_size, data_preview, message, priority,
+                   partition_key, idempotency_key, data_hash, create_uid, create_date, write_uid, write_date)
+                VALUES """ + values + """
+                ON CONFLICT DO NOTHING
+                RETURNING
+                  id, idempotency_key, data_hash"""
+            )
+
+            # In order of the inserts, without the lines skipped as
+            # duplicates of lines inserted concurrently
+            inserted = cr.fetchall()
+            position = 0
+            for index in inserts:
+                dedupe_key = dedupe_keys[index]
+                if position < len(inserted) and inserted[position][1:] == (dedupe_key or (None, None, None))[1:]:
+                    ids[index] = inserted[position][0]
+                    position += 1
+
+            attachments = [(ids[index], vals_list[index]) for index in inserts
+                           if ids[index] is not None and vals_list[index].get('file') is not None]
+            if attachments:
+                self._attach_batch(attachments)
+
+            concurrent = [dedupe_keys[index] for index in inserts if ids[index] is None]
+            if concurrent:
+                existing = self._find_duplicates(concurrent)
+                for index in inserts:
+                    if ids[index] is None:
+                        ids[index] = existing.get(dedupe_keys[index])
+
+        for index, dedupe_key in enumerate(dedupe_keys):
+            if ids[index] is None and dedupe_key in originals:
+                ids[index] = ids[originals[dedupe_key]]
+
+        return ids
+
+    @api.model
+    def _attach_batch(self, attachments):
+        """Multi-row INSERT of the attachments [(res_id, vals)] of data lines,
+        stored like ir.attachment does (filestore or database)."""
+        cr = self._cr
+        att_model = self.env['ir.attachment']
+        location = att_model._storage()
+
+        rows = []
+        for (res_id, vals) in attachments:
+            value = vals['file']
+            file_size = len(value.decode('base64'))
+
+            if location != 'db':
+                store_fname, db_datas = att_model._file_write(value), None
+            else:
+                store_fname, db_datas = None, psycopg2.Binary(value)
+
+            rows.append((
+                vals.get('filename'),
+                vals.get('filename'),
+                self._name,
+                res_id,
+                store_fname,
+                db_datas,
+                file_size,
+                self._uid,
+                self._uid
+            ))
+
+        values = ', '.join(
+            cr.mogrify("(%s, %s, %s, %s, 'binary', %s, %s, %s, %s, (now() at time zone 'UTC'), %s, (now() at time zone 'UTC'))", row)
+            for row in rows
+        )
+        cr.execute(
+            """
+            INSERT INTO ir_attachment
+              (name, datas_fname, res_model, res_id, type, store_fname, db_datas, file_size,
+               create_uid, create_date, write_uid, write_date)
+            VALUES """ + values
+        )
+
+    @api.model
+    def _claim_jobs(self, application_id, limit, claim_uuid):
+        """Claim the next `limit` ready jobs of the application, in order of
+        priority, in one statement. Rows locked by others are skipped (not
+        waited for), so concurrent threads/processes never collide.
+
+        Returns the jobs, the seconds each one waited since it got ready
+        (or due) and the ids of the jobs with a partition key.
+
+        The lookup matches the partial index of the ready rows (application,
+        then in order of priority and id), so it only ever reads the
+        backlog.
+
+        Of the lines with a partition key, only the first ready one (by id)
+        of a key is claimed, and none while another line of the key is in
+        processing: FIFO per key, different keys in parallel."""
+        self._cr.execute(
+            """
+            UPDATE
+              application_integration_data
+            SET
+              state = 'processing',
+              claim_uuid = %s,
+              attempt_count = attempt_count + 1
+            WHERE
+              id IN (
+                SELECT
+                  id
+                FROM
+                  application_integration_data
+                WHERE
+                  application = %s
+                  AND state = 'ready'
+                  AND (next_attempt_at IS NULL OR next_attempt_at <= (now() at time zone 'UTC'))
+                  AND (
+                    partition_key IS NULL
+                    OR NOT EXISTS (
+                      SELECT
+                        1
+                      FROM
+                        application_integration_data AS other
+                      WHERE
+                        other.application = application_integration_data.application
+                        AND other.partition_key = application_integration_data.partition_key
+                        AND other.partition_key IS NOT NULL
+                        AND other.state IN ('ready', 'processing')
+                        AND other.id <> application_integration_data.id
+                        AND (other.state = 'processing' OR other.id < application_integration_data.id)
+                    )
+                  )
+                ORDER BY
+                  priority, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+              )
+            RETURNING
+              id,
+              priority,
+              extract(epoch FROM (now() at time zone 'UTC') - coalesce(next_attempt_at, write_date)),
+              partition_key IS NOT NULL""",
+            (claim_uuid, application_id, limit)
+        )
+
+        rows = self._cr.fetchall()
+        ids = [id for (priority, id) in sorted((priority, id) for (id, priority, wait, keyed) in rows)]
+        self.invalidate_cache(['state', 'claim_uuid', 'attempt_count'], ids)
+        return (
+            self.browse(ids),
+            [float(wait or 0) for (id, priority, wait, keyed) in rows],
+            [id for (id, priority, wait, keyed) in rows if keyed]
+        )
+
+    @api.multi
+    def _release_jobs(self, claim_uuid):
+        """Give back claimed, but unprocessed jobs."""
+        if not self:
+            return
+
+        self._cr.execute(
+            """
+            UPDATE
+              application_integration_data
+            SET
+              state = 'ready',
+              claim_uuid = NULL,
+              attempt_count = attempt_count - 1
+            WHERE
+              id IN %s
+              AND state = 'processing'
+              AND claim_uuid = %s""",
+            (tuple(self.ids), claim_uuid)
+        )
+        self.invalidate_cache(['state', 'claim_uuid', 'attempt_count'], self.ids)
+        self._notify_ready()
+
+    @api.model
+    def _requeue_jobs(self, worker_timeout):
+        """Give back jobs in processing, claimed by a scheduler which is
+        gone (not registered, or no heartbeat for `worker_timeout` seconds)
+        and not locked (thus not being processed)."""
+        self._cr.execute(
+            """
+            UPDATE
+              application_integration_data
+            SET
+              state = 'ready',
+              claim_uuid = NULL
+            WHERE
+              id IN (
+                SELECT
+                  id
+                FROM
+                  application_integration_data
+                WHERE
+                  state = 'processing'
+                  AND NOT EXISTS (
+                    SELECT
+                      1
+                    FROM
+                      application_integration_worker worker
+                    WHERE
+                      worker.uuid = application_integration_data.claim_uuid
+                      AND worker.heartbeat >= (now() at time zone 'UTC') - %s * interval '1 second'
+                  )
+                FOR UPDATE SKIP LOCKED
+              )
+            RETURNING
+              id""",
+            (worker_timeout,)
+        )
+
+        ids = [id for (id,) in self._cr.fetchall()]
+        self.invalidate_cache(['state', 'claim_uuid'], ids)
+        return ids
+
+    @api.model
+    def _requeue_claims(self, claim_uuid, busy_ids):
+        """Give back the jobs in processing claimed by the (live) scheduler
+        `claim_uuid`, but neither in its workers (`busy_ids`) nor locked:
+        left over by a failure between their claim and their result."""
+        self._cr.execute(
+            """
+            UPDATE
+              application_integration_data
+            SET
+              state = 'ready',
+              claim_uuid = NULL
+            WHERE
+              id IN (
+                SELECT
+                  id
+                FROM
+                  application_integration_data
+                WHERE
+                  state = 'processing'
+                  AND claim_uuid = %s
+                  AND NOT (id = ANY(%s))
+                FOR UPDATE SKIP LOCKED
+              )
+            RETURNING
+              id""",
+            (claim_uuid, busy_ids)
+        )
+
+        ids = [id for (id,) in self._cr.fetchall()]
+        self.invalidate_cache(['state', 'claim_uuid'], ids)
+        return ids
+
+    @api.multi
+    def _write_results(self, results):
+        """Write the processing results {id: (ok, message)}, in one
+        statement per outcome. Failed jobs of an application with a retry
+        policy get ready again (after an exponential backoff with jitter),
+        until their attempts are exhausted (dead letter).
+
+        Returns the number of jobs per resulting state."""
+        cr = self._cr
+        failed_ids = [id for (id, (ok, message)) in results.items() if not ok]
+
+        retries = {}
+        if failed_ids:
+            cr.execute(
+                """
+                SELECT
+                  data.id, data.attempt_count, app.max_attempts, app.retry_delay, app.retry_jitter
+                FROM
+                  application_integration_data AS data
+                  JOIN application_integration_application AS app ON app.id = data.application
+                WHERE
+                  data.id IN %s""",
+                (tuple(failed_ids),)
+            )
+            now = datetime.utcnow()
+            for (id, attempt_count, max_attempts, retry_delay, retry_jitter) in cr.fetchall():
+                if (max_attempts or 1) <= 1:
+                    continue
+                if attempt_count < max_attempts:
+                    delay = retry_backoff(attempt_count, retry_delay or 0, retry_jitter or 0.0)
+                    retries[id] = ('ready', (now + timedelta(seconds=delay)).strftime(DEFAULT_SERVER_DATETIME_FORMAT))
+                else:
+                    retries[id] = ('dead', None)
+
+        rows_by_state = {}
+        for id, (ok, message) in results.items():
+            if ok:
+                state, next_attempt_at = 'done', None
+            else:
+                state, next_attempt_at = retries.get(id, ('error', None))
+            rows_by_state.setdefault(state, []).append((id, message or None, next_attempt_at))
+
+        for state, rows in rows_by_state.items():
+            values = ', '.join(cr.mogrify('(%s, %s, %s)', row) for row in rows)
+            cr.execute(
+                cr.mogrify(
+                    """
+                    UPDATE
+                      application_integration_data AS data
+                    SET
+                      state = %s,
+                      message = result.message,
+                      next_attempt_at = result.next_attempt_at::timestamp,
+                      write_uid = %s,
+                      write_date = (now() at time zone 'UTC')
+                    FROM
+                      (VALUES """, (state, self._uid)
+                ) + values + """) AS result(id, message, next_attempt_at)
+                    WHERE
+                      data.id = result.id"""
+            )
+
+        self.invalidate_cache(['state', 'message', 'next_attempt_at', 'write_uid', 'write_date'], list(results))
+        return dict((state, len(rows)) for (state, rows) in rows_by_state.items())
+
+    @api.multi
+    def _notify_ready(self):
+        """Wake up the scheduler(s), by a NOTIFY on the
+        application channel. Delivered on commit of this transaction."""
+        for application_id in set(self.mapped('application.id')):
+            self._cr.execute("SELECT pg_notify(%s, '')", (NOTIFY_CHANNEL % application_id,))
+
+    @api.model
+    def _purge(self, ids):
+        """Delete the data lines `ids` with their messages, followers and
+        attachments, a statement per table (no ORM unlink per record).
+
+        Returns the files of the deleted attachments, to be deleted from the
+        filestore once committed."""
+        ids = tuple(ids)
+        self._cr.execute(
+            "SELECT DISTINCT store_fname FROM ir_attachment "
+            " WHERE res_model = %s AND res_id IN %s AND store_fname IS NOT NULL",
+            (self._name, ids)
+        )
+        fnames = [fname for (fname,) in self._cr.fetchall()]
+
+        self._cr.execute("DELETE FROM ir_attachment WHERE res_model = %s AND res_id IN %s", (self._name, ids))
+        self._cr.execute("DELETE FROM mail_message WHERE model = %s AND res_id IN %s", (self._name, ids))
+        self._cr.execute("DELETE FROM mail_followers WHERE res_model = %s AND res_id IN %s", (self._name, ids))
+        self._cr.execute("DELETE FROM application_integration_data WHERE id IN %s", (ids,))
+
+        self.invalidate_cache(ids=list(ids))
+        return fnames
+
     def test_rapid_process(self, obj):
         msg = 'Test rapid process'
         _logger.error(msg)
         return [True, msg]
 
+    def test_rapid_batch_process(self, objs):
+        msg = 'Test rapid batch process'
+        _logger.error('%s: %s lines' % (msg, len(objs)))
+        return dict((obj.id, [True, msg]) for obj in objs)
+
     def test_slow_process(self, obj):
         interval = 5
         msg = 'test slow process (%s seconds)' % interval
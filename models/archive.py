@@ -0,0 +1,231 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+Archive of processed data lines (see the retention of the applications): a
+plain table, range partitioned by month of archiving when PostgreSQL
+supports it (10+), so expired archives are dropped a partition at a time
+instead of deleted row by row.
+"""
+import logging
+import re
+from datetime import date
+
+from openerp import models, fields, api
+
+from payload import unpack_payload
+
+_logger = logging.getLogger(__name__)
+
+# Months archives are kept (parameter application_integration.archive_months,
+# 0 keeps them forever)
+ARCHIVE_MONTHS = 12
+
+
+def _month_start(day, months=0):
+    """First day of the month of `day`, `months` later (or earlier)"""
+    month = day.year * 12 + day.month - 1 + months
+    return date(month // 12, month % 12 + 1, 1)
+
+
+class ApplicationIntegrationDataArchive(models.Model):
+    _name = 'application.integration.data.archive'
+    _description = "Application Integration Framework Data (archived)"
+    _auto = False
+    _order = 'archive_date desc, id desc'
+
+    application = fields.Many2one(
+        'application.integration.application',
+        "Application",
+        readonly=True
+    )
+    state = fields.Selection(
+        [
+            ('cancel', 'Cancelled'),
+            ('done', 'Done')
+        ],
+        string="State",
+        readonly=True
+    )
+    priority = fields.Integer(
+        "Priority",
+        readonly=True
+    )
+    attempt_count = fields.Integer(
+        "Attempts",
+        readonly=True
+    )
+    message = fields.Text(
+        "Processing Message",
+        readonly=True
+    )
+    data = fields.Text(
+        "Data",
+        compute='_compute_data'
+    )
+    data_size = fields.Integer(
+        "Data Size",
+        readonly=True
+    )
+    data_preview = fields.Char(
+        "Data Preview",
+        readonly=True
+    )
+    archive_date = fields.Date(
+        "Archived On",
+        readonly=True
+    )
+
+    def init(self, cr):
+        cr.execute("SELECT 1 FROM pg_class WHERE relname = %s", (self._table,))
+        if cr.fetchone():
+            return
+
+        partitioned = cr._cnx.server_version >= 100000
+        cr.execute(
+            """
+            CREATE TABLE application_integration_data_archive (
+              id integer NOT NULL,
+              application integer,
+              state varchar,
+              priority integer,
+              attempt_count integer,
+              message text,
+              data_inline text,
+              data_codec varchar,
+              data_size integer,
+              data_preview varchar,
+              payload bytea,
+              create_uid integer,
+              create_date timestamp,
+              write_uid integer,
+              write_date timestamp,
+              archive_date date NOT NULL
+            )""" + (" PARTITION BY RANGE (archive_date)" if partitioned else "")
+        )
+        if not partitioned:
+            cr.execute(
+                "CREATE INDEX application_integration_data_archive_application_index "
+                "ON application_integration_data_archive (application, archive_date)"
+            )
+
+    def _is_partitioned(self):
+        self._cr.execute("SELECT relkind FROM pg_class WHERE relname = %s", (self._table,))
+        row = self._cr.fetchone()
+        return bool(row) and row[0] == 'p'
+
+    def _partitions(self):
+        """{first day of the month: partition (table name)}"""
+        self._cr.execute(
+            """
+            SELECT
+              child.relname
+            FROM
+              pg_inherits
+              JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+              JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE
+              parent.relname = %s""",
+            (self._table,)
+        )
+        partitions = {}
+        for (name,) in self._cr.fetchall():
+            match = re.match(r'^%s_(\d{4})(\d{2})$' % self._table, name)
+            if match:
+                partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+        return partitions
+
+    def _ensure_partition(self, day):
+        """Partition of the month of `day`, created if needed"""
+        start = _month_start(day)
+        name = '%s_%s' % (self._table, start.strftime('%Y%m'))
+        if start in self._partitions():
+            return name
+
+        self._cr.execute(
+            'CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)' % (name, self._table),
+            (start, _month_start(start, 1))
+        )
+        self._cr.execute('CREATE INDEX IF NOT EXISTS %s_application_index ON %s (application)' % (name, name))
+        return name
+
+    @api.model
+    def _archive(self, ids):
+        """Copy the data lines `ids` (payloads as stored) to the archive"""
+        today = date.today()
+        if self._is_partitioned():
+            self._ensure_partition(today)
+
+        self._cr.execute(
+            """
+            INSERT INTO application_integration_data_archive
+              (id, application, state, priority, attempt_count, message, data_inline, data_codec,
+               data_size, data_preview, payload, create_uid, create_date, write_uid, write_date,
+               archive_date)
+            SELECT
+              id, application, state, priority, attempt_count, message, data_inline, data_codec,
+              data_size, data_preview, payload, create_uid, create_date, write_uid, write_date,
+              %s
+            FROM
+              application_integration_data
+            WHERE
+              id IN %s""",
+            (today, tuple(ids))
+        )
+
+    @api.model
+    def _expire_archives(self, months=None):
+        """Remove the archives older than `months` (whole months): drop the
+        partitions, or delete the rows of an unpartitioned archive."""
+        if months is None:
+            months = int(self.env['ir.config_parameter'].get_param(
+                'application_integration.archive_months', ARCHIVE_MONTHS))
+        if months <= 0:
+            return
+
+        cutoff = _month_start(date.today(), -months)
+        if self._is_partitioned():
+            for (start, name) in sorted(self._partitions().items()):
+                if start < cutoff:
+                    _logger.info('Dropping archive partition %s', name)
+                    self._cr.execute('DROP TABLE %s' % name)
+        else:
+            self._cr.execute("DELETE FROM application_integration_data_archive WHERE archive_date < %s", (cutoff,))
+
+    @api.model
+    def _delete_application_archives(self, application_ids):
+        self._cr.execute(
+            "DELETE FROM application_integration_data_archive WHERE application IN %s",
+            (tuple(application_ids),)
+        )
+
+    @api.multi
+    def _compute_data(self):
+        payloads = {}
+        if self.ids:
+            self._cr.execute(
+                "SELECT id, data_inline, payload, data_codec FROM application_integration_data_archive WHERE id IN %s",
+                (tuple(self.ids),)
+            )
+            for (id, inline, payload, codec) in self._cr.fetchall():
+                payloads[id] = unpack_payload(inline, payload, codec)
+
+        for record in self:
+            record.data = payloads.get(record.id, False)
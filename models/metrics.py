@@ -0,0 +1,206 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+In-memory (per process) metrics of the processing loop: histograms of the
+claim, pickup, handler and commit timings and counters of the outcomes, per
+application. Rendered in the Prometheus text format by the metrics
+controller.
+"""
+import bisect
+import threading
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600)
+
+PHASES = (
+    ('pickup', "Seconds between a job got ready and its claim"),
+    ('claim', "Seconds to claim (and commit) a batch of jobs"),
+    ('handler', "Seconds in the method called for a job (or batch of jobs)"),
+    ('commit', "Seconds to commit a job (or batch of jobs) and write its state"),
+)
+
+# ApplicationMetrics, by (dbname, application id)
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+class Histogram(object):
+    """Cumulative histogram, Prometheus style"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(BUCKETS, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        """([cumulative count per bucket, +Inf last], sum)"""
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+
+        cumulative, running = [], 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+def histogram_quantile(cumulative, q):
+    """Estimate of the q-quantile (0 <= q <= 1) of a histogram snapshot,
+    interpolated linearly within the bucket (like Prometheus does)"""
+    total = cumulative[-1]
+    if not total:
+        return None
+
+    rank = q * total
+    lower_bound, lower_count = 0.0, 0
+    for bound, count in zip(BUCKETS, cumulative):
+        if count >= rank:
+            if count == lower_count:
+                return bound
+            return lower_bound + (bound - lower_bound) * (rank - lower_count) / (count - lower_count)
+        lower_bound, lower_count = bound, count
+
+    # In the +Inf bucket
+    return BUCKETS[-1]
+
+
+class JobStats(object):
+    """Timings and outcomes of processed jobs, collected by a job processor
+    (possibly in a worker process) and added to the ApplicationMetrics"""
+
+    def __init__(self):
+        self.handler = []
+        self.commit = []
+        self.outcomes = {}
+
+    def count(self, outcomes):
+        for state, count in outcomes.items():
+            self.outcomes[state] = self.outcomes.get(state, 0) + count
+
+
+class ApplicationMetrics(object):
+    """Metrics of an application"""
+
+    def __init__(self):
+        self.histograms = dict((phase, Histogram()) for (phase, help) in PHASES)
+        self.outcomes = {}
+        self.lock = threading.Lock()
+
+    def observe(self, phase, seconds):
+        self.histograms[phase].observe(seconds)
+
+    def add(self, stats):
+        for seconds in stats.handler:
+            self.observe('handler', seconds)
+        for seconds in stats.commit:
+            self.observe('commit', seconds)
+
+        with self.lock:
+            for state, count in stats.outcomes.items():
+                self.outcomes[state] = self.outcomes.get(state, 0) + count
+
+
+def application_metrics(dbname, application_id):
+    key = (dbname, application_id)
+    metrics = _metrics.get(key)
+    if metrics is None:
+        with _metrics_lock:
+            metrics = _metrics.setdefault(key, ApplicationMetrics())
+    return metrics
+
+
+def _labels(**labels):
+    return '{%s}' % ','.join(
+        '%s="%s"' % (key, unicode(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for (key, value) in sorted(labels.items())
+    )
+
+
+def _le(bound):
+    return ('%f' % bound).rstrip('0').rstrip('.')
+
+
+def render_metrics(dbname, names, queue, in_flight):
+    """Prometheus text format of the metrics of the applications (`names`:
+    {id: name}) of a database, with the queue gauges (`queue`: {id: {state:
+    (count, oldest age)}}) and the jobs in flight ({id: count}) of the
+    scheduler of this process."""
+    lines = []
+
+    lines.append('# HELP application_integration_jobs_total Processed jobs, by resulting state')
+    lines.append('# TYPE application_integration_jobs_total counter')
+    for app_id, name in sorted(names.items()):
+        metrics = _metrics.get((dbname, app_id))
+        if metrics is None:
+            continue
+        with metrics.lock:
+            outcomes = dict(metrics.outcomes)
+        for state, count in sorted(outcomes.items()):
+            lines.append('application_integration_jobs_total%s %s' % (
+                _labels(application=name, application_id=app_id, state=state), count))
+
+    for phase, help in PHASES:
+        metric = 'application_integration_%s_seconds' % phase
+        lines.append('# HELP %s %s' % (metric, help))
+        lines.append('# TYPE %s histogram' % metric)
+
+        for app_id, name in sorted(names.items()):
+            metrics = _metrics.get((dbname, app_id))
+            if metrics is None:
+                continue
+
+            cumulative, total = metrics.histograms[phase].snapshot()
+            for bound, count in zip(BUCKETS, cumulative):
+                lines.append('%s_bucket%s %s' % (
+                    metric, _labels(application=name, application_id=app_id, le=_le(bound)), count))
+            lines.append('%s_bucket%s %s' % (
+                metric, _labels(application=name, application_id=app_id, le='+Inf'), cumulative[-1]))
+            lines.append('%s_sum%s %r' % (metric, _labels(application=name, application_id=app_id), total))
+            lines.append('%s_count%s %s' % (metric, _labels(application=name, application_id=app_id), cumulative[-1]))
+
+    lines.append('# HELP application_integration_queue_depth Data lines ready for or in processing')
+    lines.append('# TYPE application_integration_queue_depth gauge')
+    for app_id, name in sorted(names.items()):
+        for state in ('ready', 'processing'):
+            count, age = queue.get(app_id, {}).get(state, (0, None))
+            lines.append('application_integration_queue_depth%s %s' % (
+                _labels(application=name, application_id=app_id, state=state), count))
+
+    lines.append('# HELP application_integration_oldest_ready_seconds Age of the oldest data line ready for processing')
+    lines.append('# TYPE application_integration_oldest_ready_seconds gauge')
+    for app_id, name in sorted(names.items()):
+        count, age = queue.get(app_id, {}).get('ready', (0, None))
+        lines.append('application_integration_oldest_ready_seconds%s %r' % (
+            _labels(application=name, application_id=app_id), float(age or 0)))
+
+    lines.append('# HELP application_integration_in_flight Jobs dispatched to the workers of this process')
+    lines.append('# TYPE application_integration_in_flight gauge')
+    for app_id, name in sorted(names.items()):
+        lines.append('application_integration_in_flight%s %s' % (
+            _labels(application=name, application_id=app_id), in_flight.get(app_id, 0)))
+
+    return '\n'.join(lines) + '\n'
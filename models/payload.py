@@ -0,0 +1,136 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+Payload storage of application.integration.data: small payloads are kept
+inline (text), larger ones compressed in a bytea column (`payload`), which
+the ORM never reads (nor prefetches).
+"""
+import hashlib
+import json
+import logging
+import zlib
+
+import lxml.etree as etree
+
+try:
+    import zstd
+except ImportError:
+    zstd = None
+
+import psycopg2
+
+_logger = logging.getLogger(__name__)
+
+# Characters of the data shown in lists
+PREVIEW_SIZE = 200
+
+# Characters of pretty printed data shown in forms
+PRETTY_SIZE = 100000
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def pack_payload(data, threshold, codec='zlib'):
+    """Column values (data_inline, payload, data_codec, data_size,
+    data_preview) to store `data`"""
+    if not data:
+        return (None, None, None, 0, None)
+
+    raw = data.encode('utf-8') if isinstance(data, unicode) else data
+    preview = preview_payload(data)
+
+    if len(raw) <= threshold:
+        return (data, None, None, len(raw), preview)
+
+    if codec == 'zstd' and zstd is not None:
+        compressed = zstd.compress(raw, ZSTD_LEVEL)
+    else:
+        codec = 'zlib'
+        compressed = zlib.compress(raw, ZLIB_LEVEL)
+
+    return (None, psycopg2.Binary(compressed), codec, len(raw), preview)
+
+
+def unpack_payload(inline, payload, codec):
+    """The data, stored by pack_payload"""
+    if payload is None:
+        return inline or False
+
+    if codec == 'zstd':
+        raw = zstd.decompress(str(payload))
+    else:
+        raw = zlib.decompress(str(payload))
+
+    return raw.decode('utf-8')
+
+
+def payload_hash(data):
+    """Content hash (hex SHA-256) of the data, for the deduplication"""
+    raw = data.encode('utf-8') if isinstance(data, unicode) else data
+    return hashlib.sha256(raw).hexdigest()
+
+
+def preview_payload(data):
+    """The start of the data, on one line"""
+    head = data[:PREVIEW_SIZE * 2]
+    if isinstance(head, str):
+        head = head.decode('utf-8', 'replace')
+
+    preview = ' '.join(head.split())
+    if len(preview) > PREVIEW_SIZE or len(data) > len(head):
+        preview = preview[:PREVIEW_SIZE] + '...'
+    return preview
+
+
+def payload_format(data):
+    """'xml', 'json' or None (unknown), by the first character"""
+    head = data[:64].lstrip(u'\ufeff \t\r\n')
+    if head.startswith('<'):
+        return 'xml'
+    if head.startswith('{') or head.startswith('['):
+        return 'json'
+    return None
+
+
+def prettify_payload(data, size, max_size):
+    """Pretty printed (XML, JSON) data, truncated to PRETTY_SIZE. Data
+    larger than `max_size` bytes is not parsed, but shown as is."""
+    if not data:
+        return data
+
+    pretty = data
+    fmt = payload_format(data)
+
+    if size <= max_size and fmt is not None:
+        try:
+            if fmt == 'xml':
+                parser = etree.XMLParser(encoding='utf-8', resolve_entities=False, remove_blank_text=True)
+                root = etree.fromstring(data.encode('utf-8'), parser)
+                pretty = etree.tostring(root, encoding='unicode', pretty_print=True)
+            else:
+                pretty = json.dumps(json.loads(data), indent=2, ensure_ascii=False)
+        except Exception as e:
+            _logger.debug('Data is no valid %s, shown as is: %s', fmt, e)
+
+    if len(pretty) > PRETTY_SIZE:
+        pretty = u'%s\n\n... (truncated, %s bytes in total)' % (pretty[:PRETTY_SIZE], size)
+    return pretty
@@ -0,0 +1,177 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+Opt-in profiling of the handlers of the applications: a handler call is
+profiled (cProfile), with the SQL queries on its cursor (count, time) and
+the memory delta of the process, and stored as an
+application.integration.profile.
+"""
+import cProfile
+import logging
+import pstats
+import time
+from cStringIO import StringIO
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from openerp import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Functions (by cumulative time) in the stored profile
+PROFILE_LINES = 40
+
+# Days the profiles are kept (parameter application_integration.profile_days)
+PROFILE_DAYS = 7
+
+
+def _rss():
+    """Resident memory of this process in bytes, None without psutil"""
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class JobProfiler(object):
+    """
+    Profile of a handler call (a context manager): cProfile of this thread,
+    the queries executed on the cursor of the handler and the memory delta
+    of the process (of all its threads, in the 'thread' execution mode).
+    """
+
+    def __init__(self, cr):
+        self.cr = cr
+        self.profile = cProfile.Profile()
+        self.sql_count = 0
+        self.sql_time = 0.0
+        self.duration = 0.0
+        self.memory_delta = None
+
+    def __enter__(self):
+        execute = self.cr.execute
+
+        def timed_execute(*args, **kwargs):
+            start = time.time()
+            try:
+                return execute(*args, **kwargs)
+            finally:
+                self.sql_count += 1
+                self.sql_time += time.time() - start
+
+        self.cr.execute = timed_execute
+        self.rss = _rss()
+        self.start = time.time()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profile.disable()
+        self.duration = time.time() - self.start
+        del self.cr.execute
+
+        rss = _rss()
+        if rss is not None and self.rss is not None:
+            self.memory_delta = (rss - self.rss) // 1024
+        return False
+
+    def stats(self):
+        stream = StringIO()
+        pstats.Stats(self.profile, stream=stream).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return stream.getvalue()
+
+    def values(self, handler, job_ids):
+        """Values of the application.integration.profile"""
+        return {
+            'application': handler.application_id,
+            'data_ids': [(6, 0, list(job_ids))],
+            'handler': '%s' % handler,
+            'duration': self.duration,
+            'sql_count': self.sql_count,
+            'sql_time': self.sql_time,
+            'memory_delta': self.memory_delta,
+            'stats': self.stats(),
+        }
+
+
+class ApplicationIntegrationProfile(models.Model):
+    _name = 'application.integration.profile'
+    _description = "Application Integration Profile (handler call)"
+    _order = 'id desc'
+    _rec_name = 'handler'
+
+    application = fields.Many2one(
+        'application.integration.application',
+        "Application",
+        required=True,
+        readonly=True,
+        ondelete='cascade',
+        index=True
+    )
+    data_ids = fields.Many2many(
+        'application.integration.data',
+        'application_integration_profile_data_rel',
+        'profile_id',
+        'data_id',
+        "Data Lines",
+        readonly=True
+    )
+    handler = fields.Char(
+        "Method",
+        readonly=True
+    )
+    duration = fields.Float(
+        "Duration",
+        readonly=True,
+        help="Seconds in the method"
+    )
+    sql_count = fields.Integer(
+        "SQL Queries",
+        readonly=True
+    )
+    sql_time = fields.Float(
+        "SQL Time",
+        readonly=True,
+        help="Seconds in the SQL queries of the method"
+    )
+    memory_delta = fields.Integer(
+        "Memory Delta (KB)",
+        readonly=True,
+        help="Change of the resident memory of the process during the call (of all its threads, "
+             "in the Thread execution mode). Empty without psutil."
+    )
+    stats = fields.Text(
+        "Profile",
+        readonly=True
+    )
+
+    @api.model
+    def _expire(self):
+        """Delete the profiles older than the profile_days parameter"""
+        days = int(self.env['ir.config_parameter'].get_param('application_integration.profile_days', PROFILE_DAYS))
+        self._cr.execute(
+            "DELETE FROM application_integration_profile "
+            " WHERE create_date < (now() at time zone 'UTC') - %s * interval '1 day'",
+            (days,)
+        )
+        _logger.info('Application Integration: %s expired profiles deleted', self._cr.rowcount)
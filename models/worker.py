@@ -0,0 +1,181 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+Registry of the Application Schedulers of all Odoo processes (nodes) of a
+database: each one refreshes its heartbeat, and records the applications it
+holds a processing slot of. A scheduler without a recent heartbeat is
+stale: its claimed jobs get requeued and its registration removed, by any
+other scheduler.
+"""
+import logging
+import os
+import socket
+
+from openerp import models, fields, api
+
+_logger = logging.getLogger(__name__)
+
+# Seconds between heartbeats of a scheduler
+HEARTBEAT_INTERVAL = 30
+
+# Seconds without heartbeat after which a scheduler is stale (parameter
+# application_integration.worker_timeout)
+WORKER_TIMEOUT = 120
+
+
+def worker_timeout(cr):
+    cr.execute("SELECT value FROM ir_config_parameter WHERE key = 'application_integration.worker_timeout'")
+    row = cr.fetchone()
+    return int(row[0]) if row and row[0] else WORKER_TIMEOUT
+
+
+class ApplicationIntegrationWorker(models.Model):
+    _name = 'application.integration.worker'
+    _description = "Application Integration Worker (scheduler)"
+    _order = 'hostname, pid, id'
+
+    name = fields.Char(
+        "Name",
+        readonly=True
+    )
+    uuid = fields.Char(
+        "UUID (claims)",
+        readonly=True,
+        required=True,
+        index=True
+    )
+    hostname = fields.Char(
+        "Host",
+        readonly=True
+    )
+    pid = fields.Integer(
+        "PID",
+        readonly=True
+    )
+    started_at = fields.Datetime(
+        "Started",
+        readonly=True,
+        default=fields.Datetime.now
+    )
+    heartbeat = fields.Datetime(
+        "Heartbeat",
+        readonly=True,
+        default=fields.Datetime.now
+    )
+    alive = fields.Boolean(
+        "Alive",
+        compute='_compute_alive'
+    )
+    application_ids = fields.Many2many(
+        'application.integration.application',
+        'application_integration_worker_application_rel',
+        'worker_id',
+        'application_id',
+        "Applications",
+        readonly=True,
+        help="Applications this scheduler holds a processing slot of."
+    )
+
+    _sql_constraints = [
+        ('uuid_uniq', 'unique (uuid)', 'The UUID of a worker must be unique!'),
+    ]
+
+    @api.multi
+    def _compute_alive(self):
+        timeout = worker_timeout(self._cr)
+        self._cr.execute(
+            "SELECT id FROM application_integration_worker "
+            " WHERE id IN %s AND heartbeat >= (now() at time zone 'UTC') - %s * interval '1 second'",
+            (tuple(self.ids) or (0,), timeout)
+        )
+        alive = set(id for (id,) in self._cr.fetchall())
+        for worker in self:
+            worker.alive = worker.id in alive
+
+    @api.model
+    def _heartbeat(self, uuid, name, application_ids):
+        """Register or refresh the scheduler `uuid`, leading (holding a slot
+        of) `application_ids`"""
+        self._cr.execute(
+            "UPDATE application_integration_worker SET heartbeat = (now() at time zone 'UTC') "
+            " WHERE uuid = %s RETURNING id",
+            (uuid,)
+        )
+        row = self._cr.fetchone()
+        if row:
+            worker = self.browse(row[0])
+            worker.invalidate_cache(['heartbeat'], [worker.id])
+        else:
+            # New, or removed as stale (e.g. after a long pause)
+            worker = self.create({
+                'name': name,
+                'uuid': uuid,
+                'hostname': socket.gethostname(),
+                'pid': os.getpid(),
+            })
+
+        if set(worker.application_ids.ids) != set(application_ids):
+            worker.application_ids = [(6, 0, list(application_ids))]
+        return worker
+
+    @api.model
+    def _unregister(self, uuid):
+        self._cr.execute("DELETE FROM application_integration_worker WHERE uuid = %s", (uuid,))
+
+    @api.model
+    def _expire(self, timeout):
+        """Remove the stale schedulers (their jobs are requeued, see
+        _requeue_jobs)"""
+        self._cr.execute(
+            "DELETE FROM application_integration_worker "
+            " WHERE heartbeat < (now() at time zone 'UTC') - %s * interval '1 second' "
+            " RETURNING name, hostname, pid",
+            (timeout,)
+        )
+        for (name, hostname, pid) in self._cr.fetchall():
+            _logger.warning('Application Integration scheduler %s (%s, pid %s) is stale, removed', name, hostname, pid)
+
+    @api.model
+    def _is_processing(self, application_id):
+        """Whether a live scheduler (of any node) leads the application, or
+        still has jobs of it in processing"""
+        self._cr.execute(
+            """
+            SELECT
+              1
+            FROM
+              application_integration_worker worker
+            WHERE
+              worker.heartbeat >= (now() at time zone 'UTC') - %s * interval '1 second'
+              AND (
+                EXISTS (
+                  SELECT 1 FROM application_integration_worker_application_rel rel
+                   WHERE rel.worker_id = worker.id AND rel.application_id = %s
+                )
+                OR EXISTS (
+                  SELECT 1 FROM application_integration_data data
+                   WHERE data.application = %s AND data.state = 'processing' AND data.claim_uuid = worker.uuid
+                )
+              )
+            LIMIT 1""",
+            (worker_timeout(self._cr), application_id, application_id)
+        )
+        return self._cr.fetchone() is not None
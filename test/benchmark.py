@@ -0,0 +1,242 @@
+'''
+Throughput benchmark of the processing loop (scheduler, claim, workers,
+commit), run against a local Odoo database with this module installed:
+
+    python benchmark.py -c /etc/odoo.conf -d apl_int --jobs 10000 --workers 4
+
+Seeds `--jobs` data lines (draft) for `--applications` benchmark
+applications, sets them all ready at once, starts the applications and
+waits until every line is processed. Prints one JSON document: throughput,
+pickup/claim/handler/commit latency percentiles (estimated from the metrics
+histograms), outcomes and database connection usage.
+
+Use a scratch database: the benchmark applications and their data lines
+are removed afterwards (unless --keep).
+'''
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import closing
+
+import openerp
+from openerp import api, SUPERUSER_ID
+from openerp.modules.registry import RegistryManager
+
+from openerp.addons.application_integration.models.application_integration import ApplicationScheduler
+from openerp.addons.application_integration.models.metrics import (
+    BUCKETS, PHASES, application_metrics, histogram_quantile
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-c', '--config', help="Odoo configuration file")
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('--jobs', type=int, default=1000, help="Data lines, in total")
+    parser.add_argument('--applications', type=int, default=1)
+    parser.add_argument('--handler', default='test_rapid_process',
+                        help="Method of application.integration.data to call")
+    parser.add_argument('--batch-method', action='store_true',
+                        help="The handler is a batch method (e.g. test_rapid_batch_process)")
+    parser.add_argument('--batch-size', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=1, help="Workers per application")
+    parser.add_argument('--execution-mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--transaction-mode', choices=['job', 'batch'], default='job')
+    parser.add_argument('--scheduler-workers', type=int, help="Workers of the scheduler, in total")
+    parser.add_argument('--payload-size', type=int, default=100, help="Bytes of data per line")
+    parser.add_argument('--timeout', type=float, default=3600, help="Seconds to wait for the lines")
+    parser.add_argument('--keep', action='store_true', help="Keep the applications and data lines")
+    parser.add_argument('--verbose', action='store_true', help="Keep the (per job) logging of the handlers")
+    return parser.parse_args()
+
+
+class ConnectionSampler(threading.Thread):
+    """Samples the number of connections to the database"""
+
+    def __init__(self, registry, dbname, interval=0.1):
+        super(ConnectionSampler, self).__init__(name='benchmark.connections')
+        self.registry = registry
+        self.dbname = dbname
+        self.interval = interval
+        self.stopper = threading.Event()
+        self.samples = []
+
+    def run(self):
+        with closing(self.registry.cursor()) as cr:
+            cr.autocommit(True)
+            while not self.stopper.is_set():
+                cr.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = %s", (self.dbname,))
+                self.samples.append(cr.fetchone()[0])
+                self.stopper.wait(self.interval)
+
+
+def seed(env, args, run_id):
+    """Create the (not started) applications and their draft data lines"""
+    app_model = env['application.integration.application']
+    data_model = env['application.integration.data']
+
+    apps = app_model.browse()
+    for index in range(args.applications):
+        apps |= app_model.create({
+            'name': 'benchmark %s %s' % (run_id, index + 1),
+            'user_id': SUPERUSER_ID,
+            'model': 'application.integration.data',
+            'function': args.handler,
+            'batch_method': args.batch_method,
+            'batch_size': args.batch_size,
+            'max_workers': args.workers,
+            'execution_mode': args.execution_mode,
+            'transaction_mode': args.transaction_mode,
+        })
+
+    data = 'x' * args.payload_size
+    vals_list = [
+        {'application': apps[index % len(apps)].id, 'state': 'draft', 'data': data}
+        for index in range(args.jobs)
+    ]
+    data_model.create_batch(vals_list)
+    return apps
+
+
+def remaining(cr, app_ids):
+    cr.execute(
+        "SELECT count(*) FROM application_integration_data "
+        " WHERE application IN %s AND state NOT IN ('done', 'error', 'dead')",
+        (tuple(app_ids),)
+    )
+    return cr.fetchone()[0]
+
+
+def summarize(dbname, app_ids):
+    """Latency percentiles and outcomes, over all benchmark applications"""
+    latencies = {}
+    for phase, help in PHASES:
+        cumulative, total = [0] * (len(BUCKETS) + 1), 0.0
+        for app_id in app_ids:
+            app_cumulative, app_total = application_metrics(dbname, app_id).histograms[phase].snapshot()
+            cumulative = [count + app_count for (count, app_count) in zip(cumulative, app_cumulative)]
+            total += app_total
+
+        latencies[phase] = {
+            'count': cumulative[-1],
+            'mean': total / cumulative[-1] if cumulative[-1] else None,
+            'p50': histogram_quantile(cumulative, 0.50),
+            'p95': histogram_quantile(cumulative, 0.95),
+            'p99': histogram_quantile(cumulative, 0.99),
+        }
+
+    outcomes = {}
+    for app_id in app_ids:
+        for state, count in application_metrics(dbname, app_id).outcomes.items():
+            outcomes[state] = outcomes.get(state, 0) + count
+
+    return latencies, outcomes
+
+
+def main():
+    args = parse_args()
+
+    config_args = ['-d', args.database]
+    if args.config:
+        config_args = ['-c', args.config] + config_args
+    openerp.tools.config.parse_config(config_args)
+    openerp.netsvc.init_logger()
+
+    if not args.verbose:
+        logging.getLogger('openerp.addons.application_integration').setLevel(logging.CRITICAL)
+
+    dbname = args.database
+    registry = RegistryManager.get(dbname)
+    run_id = uuid.uuid4().hex[:8]
+
+    with api.Environment.manage(), closing(registry.cursor()) as cr:
+        env = api.Environment(cr, SUPERUSER_ID, {})
+
+        params = env['ir.config_parameter']
+        previous_workers = params.get_param('application_integration.scheduler_workers')
+        if args.scheduler_workers:
+            params.set_param('application_integration.scheduler_workers', str(args.scheduler_workers))
+
+        apps = seed(env, args, run_id)
+        app_ids = apps.ids
+        cr.commit()
+
+        sampler = ConnectionSampler(registry, dbname)
+        sampler.setDaemon(True)
+        sampler.start()
+
+        # All lines ready at once (and the applications started)
+        start = time.time()
+        cr.execute(
+            "UPDATE application_integration_data "
+            "   SET state = 'ready', write_date = (now() at time zone 'UTC') "
+            " WHERE application IN %s",
+            (tuple(app_ids),)
+        )
+        for app in apps:
+            app.start_application_thread()
+
+        while remaining(cr, app_ids) and time.time() - start < args.timeout:
+            cr.commit()
+            time.sleep(0.1)
+        elapsed = time.time() - start
+        left = remaining(cr, app_ids)
+
+        for app in apps:
+            app.stop_application_thread()
+
+        sampler.stopper.set()
+        sampler.join()
+
+        scheduler = ApplicationScheduler.get(dbname)
+        if scheduler is not None:
+            scheduler.shutdown()
+
+        latencies, outcomes = summarize(dbname, app_ids)
+
+        if args.scheduler_workers:
+            # Back to the configured number of workers (or the default)
+            if previous_workers:
+                params.set_param('application_integration.scheduler_workers', previous_workers)
+            else:
+                params.search([('key', '=', 'application_integration.scheduler_workers')]).unlink()
+
+        if not args.keep:
+            cr.execute("DELETE FROM application_integration_data WHERE application IN %s", (tuple(app_ids),))
+            apps.unlink()
+        cr.commit()
+
+    processed = args.jobs - left
+    samples = sampler.samples or [0]
+    print json.dumps({
+        'run_id': run_id,
+        'config': {
+            'jobs': args.jobs,
+            'applications': args.applications,
+            'handler': args.handler,
+            'batch_method': args.batch_method,
+            'batch_size': args.batch_size,
+            'workers': args.workers,
+            'execution_mode': args.execution_mode,
+            'transaction_mode': args.transaction_mode,
+            'scheduler_workers': args.scheduler_workers,
+            'payload_size': args.payload_size,
+        },
+        'elapsed': elapsed,
+        'processed': processed,
+        'timed_out': left > 0,
+        'jobs_per_second': processed / elapsed if elapsed else None,
+        'latency': latencies,
+        'outcomes': outcomes,
+        'connections': {
+            'max': max(samples),
+            'mean': float(sum(samples)) / len(samples),
+        },
+    }, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,16 @@ args = {'application':1,
 rec = sock.execute(dbname, uid, pwd, 'application.integration.data', 'create', args)
 print rec
 
+# bulk: multi-row inserts, no chatter, all lines ready with one wakeup
+#recs = sock.execute(dbname, uid, pwd, 'application.integration.data', 'create_batch',
+#                    [{'application': 1, 'data': "line %s" % i} for i in range(1000)], True)
+#print recs
+
+# split a (large) XML file into a data line per record element (Split Tag)
+#recs = sock.execute(dbname, uid, pwd, 'application.integration.data', 'create_from_file',
+#                    1, base64string, "Hallooooo2.xml")
+#print len(recs)
+
 #rec = sock.execute(dbname, uid, pwd, 'application.integration.data', 'process')
 #print rec
 
@@ -0,0 +1,113 @@
+# -*- encoding: utf-8 -*-
+##############################################################################
+#
+#    open2bizz
+#    Copyright (C) 2017 open2bizz (open2bizz.nl).
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+##############################################################################
+"""
+Scheduling state without database: the token bucket of the rate limits and
+the wait of the Application Scheduler.
+"""
+import os
+import time
+import unittest2
+
+from openerp.addons.application_integration.models.application_integration import (
+    ApplicationScheduler, ScheduledApplication, TokenBucket, RATE_MIN_FACTOR
+)
+
+
+class TestTokenBucket(unittest2.TestCase):
+
+    def test_burst(self):
+        self.assertEqual(TokenBucket(5, 10).available(), 10)
+        # Default: a second worth of jobs
+        self.assertEqual(TokenBucket(2.5, 0).burst, 3)
+
+    def test_take_and_delay(self):
+        bucket = TokenBucket(5, 5)
+        self.assertEqual(bucket.delay(5), 0)
+
+        bucket.take(5)
+        self.assertEqual(bucket.available(), 0)
+        self.assertAlmostEqual(bucket.delay(1), 0.2, delta=0.05)
+        self.assertAlmostEqual(bucket.delay(5), 1.0, delta=0.05)
+
+    def test_adapt(self):
+        bucket = TokenBucket(8, 8)
+        self.assertTrue(bucket.adapt(0, 1))
+        self.assertEqual(bucket.rate, 4)
+
+        for i in range(10):
+            bucket.adapt(0, 1)
+        self.assertEqual(bucket.rate, 8 * RATE_MIN_FACTOR)
+        self.assertFalse(bucket.adapt(0, 1))
+
+        for i in range(20):
+            bucket.adapt(1, 0)
+        self.assertEqual(bucket.rate, 8)
+
+
+class TestNextTimeout(unittest2.TestCase):
+
+    def setUp(self):
+        self.scheduler = ApplicationScheduler('test', None)
+        self.scheduler.pool_size = 2
+
+        now = time.time()
+        self.scheduler.next_refresh = self.scheduler.next_heartbeat = now + 60
+
+        self.app = ScheduledApplication(1)
+        self.app.leading = True
+        self.app.handler = object()
+        self.app.max_workers = 2
+        self.app.next_poll = now + 60
+        self.app.bucket = TokenBucket(5, 5)
+        self.scheduler.applications[1] = self.app
+
+    def tearDown(self):
+        os.close(self.scheduler._wakeup_r)
+        os.close(self.scheduler._wakeup_w)
+
+    def busy(self, count):
+        self.scheduler.in_flight = self.app.in_flight = count
+
+    def test_tokens_available(self):
+        self.assertGreater(self.scheduler.next_timeout(), 50)
+
+    def test_rate_limited(self):
+        self.app.bucket.take(5)
+        self.assertLess(self.scheduler.next_timeout(), 1)
+
+    def test_workers_busy(self):
+        # Not a busy loop: the workers wake the scheduler up when done
+        self.busy(2)
+        self.assertGreater(self.scheduler.next_timeout(), 50)
+
+        self.app.bucket.take(5)
+        self.assertGreater(self.scheduler.next_timeout(), 50)
+
+    def test_pool_full(self):
+        self.scheduler.in_flight = 2
+        self.app.bucket.take(5)
+        self.assertGreater(self.scheduler.next_timeout(), 50)
+
+    def test_max_in_flight(self):
+        self.app.max_in_flight = 3
+        self.app.jobs_in_flight = 3
+        self.app.bucket.take(5)
+        self.assertGreater(self.scheduler.next_timeout(), 50)
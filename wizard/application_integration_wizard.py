@@ -19,28 +19,133 @@
 #
 ##############################################################################
 
-from openerp.osv import fields, orm
-from openerp import pooler
+from openerp import models, fields, api, exceptions
+from openerp.modules.registry import RegistryManager
+from openerp.tools import split_every
 from openerp.tools.translate import _
 
+from contextlib import closing
+import threading
+
 import logging
 _logger = logging.getLogger(__name__)
 
-class application_integration_ready(orm.TransientModel):
+# Data lines per statement (and transaction) of a bulk state transition
+BULK_CHUNK = 1000
+
+# Above this many data lines, a transition runs in the background
+BULK_SYNC_LIMIT = 5000
+
+
+class application_integration_bulk(models.AbstractModel):
+	"""Set-based state transition of the selected data lines (or all lines
+	matching the filter), in chunks; in the background, with progress, for
+	large selections."""
+	_name = 'application.integration.data.bulk'
+	_description = "Bulk state transition of datalines"
+
+	use_domain = fields.Boolean('All lines matching the filter'
+							, help='Checked means all data lines matching the current filter, not only the selected ones')
+	has_domain = fields.Boolean(default=lambda self: bool(self.env.context.get('active_domain')))
+	bulk_state = fields.Selection([('draft', 'Draft'), ('running', 'Running'), ('done', 'Done')]
+							, string='Progress State', default='draft', readonly=True)
+	total = fields.Integer('Lines', readonly=True)
+	processed = fields.Integer('Processed', readonly=True)
+	changed = fields.Integer('Changed', readonly=True
+							, help='Lines changed; the others were not in a state allowing the change')
+
+	def _target_ids(self):
+		context = self.env.context
+		if self.use_domain and context.get('active_domain') is not None:
+			return self.env['application.integration.data'].search(context['active_domain']).ids
+		return context.get('active_ids') or []
+
+	@api.multi
+	def _run_transition(self, state, note=None):
+		"""Transition the target lines to `state`: right away for small
+		selections, otherwise in a background thread (a transaction per
+		chunk), reporting its progress on the wizard."""
+		self.ensure_one()
+		ids = self._target_ids()
+		if not ids:
+			raise exceptions.Warning(_('You must select at least one data line!'))
+
+		# Before a background thread starts; the lines are checked per chunk
+		self.env['application.integration.data'].check_access_rights('write')
+
+		self.write({'bulk_state': 'running', 'total': len(ids), 'processed': 0, 'changed': 0})
+
+		if len(ids) <= BULK_SYNC_LIMIT:
+			data_model = self.env['application.integration.data']
+			changed = 0
+			for chunk in split_every(BULK_CHUNK, ids):
+				changed += len(data_model._transition(list(chunk), state, note))
+			self.write({'bulk_state': 'done', 'processed': len(ids), 'changed': changed})
+			return {"type": "ir.actions.client", "tag": "reload",}
+
+		# The wizard must be visible to the thread
+		self._cr.commit()
+
+		thread = threading.Thread(
+			target=self._transition_thread,
+			args=(self._cr.dbname, self._uid, dict(self.env.context), self.id, ids, state, note),
+			name='application_integration.bulk.%s' % self.id
+		)
+		thread.setDaemon(True)
+		thread.start()
+		return self._progress_action()
+
+	def _transition_thread(self, dbname, uid, context, wizard_id, ids, state, note):
+		table = self._table
+		try:
+			registry = RegistryManager.get(dbname)
+			with api.Environment.manage():
+				for chunk in split_every(BULK_CHUNK, ids):
+					with closing(registry.cursor()) as cr:
+						env = api.Environment(cr, uid, context)
+						changed = env['application.integration.data']._transition(list(chunk), state, note)
+						cr.execute(
+							"UPDATE " + table + " SET processed = processed + %s, changed = changed + %s WHERE id = %s",
+							(len(chunk), len(changed), wizard_id)
+						)
+						cr.commit()
+
+				with closing(registry.cursor()) as cr:
+					cr.execute("UPDATE " + table + " SET bulk_state = 'done' WHERE id = %s", (wizard_id,))
+					cr.commit()
+		except Exception:
+			_logger.exception('Bulk transition to %s of %s data lines failed', state, len(ids))
+
+	@api.multi
+	def _progress_action(self):
+		return {
+			'type': 'ir.actions.act_window',
+			'res_model': self._name,
+			'res_id': self.id,
+			'view_type': 'form',
+			'view_mode': 'form',
+			'target': 'new',
+			'context': self.env.context,
+		}
+
+	@api.multi
+	def refresh_progress(self):
+		return self._progress_action()
+
+
+class application_integration_ready(models.TransientModel):
 	_name = 'application.integration.data.wizard'
+	_inherit = 'application.integration.data.bulk'
 	_description = "Ready to process dataline"
-	
-	def set_ready(self, cr, uid,ids,context=None):
-		pool = pooler.get_pool(cr.dbname)
-		ids = context.get('active_ids')
-		if not ids or len(ids) < 1:
-			raise orm.except_orm(_('Error !'), _('You must select at least one data line!'))
-		self.pool.get('application.integration.data').write(cr, uid, ids,{'state' : 'ready'})		
-		return True
-
-from openerp import models, fields, api, pooler, exceptions
-class application_integration_cancel(orm.TransientModel):
+
+	@api.multi
+	def set_ready(self):
+		return self._run_transition('ready')
+
+
+class application_integration_cancel(models.TransientModel):
 	_name = 'application.integration.data.cancel.wizard'
+	_inherit = 'application.integration.data.bulk'
 	_description = "Cancel dataline"
 	
 	change_reason = fields.Text('Change reason'
@@ -48,11 +153,5 @@ class application_integration_cancel(orm.TransientModel):
 							, help='Please enter a reason for this change')
 	
 	@api.multi
-	def do_cancel(self, ids,context=None):
-		ids = ids.get('active_ids')
-		for rec in self.env['application.integration.data'].browse(ids):
-			rec.message_post("Cancelled line. Reason for change: %s" % (self.change_reason), context=context)
-			rec.state = 'cancel'
-			
-		return {"type": "ir.actions.client", "tag": "reload",}
-
+	def do_cancel(self):
+		return self._run_transition('cancel', "Cancelled line. Reason for change: %s" % (self.change_reason))